@@ -1,29 +1,62 @@
+import asyncio
+import hashlib
 import logging
-import json
+import orjson
+import re
+from enum import IntEnum
 from chat_session import ChatSession
 from gemini_bot import GeminiBot
 from ollama_bot import OllamaBot
-from web_rag_utils import create_vector_store_from_web, retrieve_context_from_vector_store
+from semantic_cache import SemanticCache, answer_namespace
+from web_rag_utils import (embed_query, get_vector_store_for_url, needs_context, retrieve_context_from_vector_store,
+                           run_in_rag_executor)
 
 from parsers.lead_parser import LeadParser
 from integrations.crm_router import CRMRouter
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Exact-match cache of LLM replies, shared by all users: identical prompts (same LLM, history and context)
+# such as repeated greetings are answered without another LLM round-trip.
+_RESPONSE_CACHE = TTLCache(maxsize=1024, ttl=3600) # {key: (response_text, in_tokens, out_tokens)}
+
+def _response_cache_key(llm_type: str, history: list, context: str | None) -> bytes:
+    """Builds the response cache key from everything that determines the LLM's reply."""
+    key_hash = hashlib.blake2b(orjson.dumps(history), digest_size=16)
+    key_hash.update(f"\x1f{context}\x1f{llm_type}".encode('utf-8'))
+    return key_hash.digest()
+
+# Answers to RAG questions, keyed by the meaning of the question per tenant, user, LLM and source URL, so a user's
+# rephrasings of an earlier question skip both retrieval and the LLM call. Answers depend on the user's chat
+# history, so they are never shared between users; namespaces of users inactive the longest are dropped first.
+_SEMANTIC_CACHE = SemanticCache(threshold=0.95, maxsize=64, ttl=3600, max_namespaces=1024)
+
+_URL_RE = re.compile(r"^https?://[^\s/$.?#][^\s]*$", re.IGNORECASE)
+
 # Define conversation states
-STATE_INITIAL = "initial"
-STATE_AWAITING_NAME = "awaiting_name"
-STATE_AWAITING_EMAIL = "awaiting_email"
-STATE_LEAD_COLLECTED = "lead_collected"
-STATE_RAG_AWAITING_URL = "rag_awaiting_url"
+class ConversationState(IntEnum):
+    """Where a user is in the conversation; an IntEnum so state checks are plain integer comparisons."""
+    INITIAL = 0
+    AWAITING_NAME = 1
+    AWAITING_EMAIL = 2
+    LEAD_COLLECTED = 3
+    RAG_AWAITING_URL = 4
 
 class BotHandler:
+    # One handler lives per chat user, so skip the per-instance __dict__
+    __slots__ = ("user_id", "session", "llm_bots", "_current_llm", "active_tenant_config", "rag_state", "crm_state",
+                 "_command_handlers", "lead_parser", "crm_router", "_lead_lookup", "message_lock")
+
     def __init__(self, user_id: str, llm_bots: dict, active_tenant_config: dict):
         self.user_id = user_id
         self.session = ChatSession()
         self.llm_bots = llm_bots
         self._current_llm = None
         self.active_tenant_config = active_tenant_config # Store the active tenant config
+        # Held by the caller while handling this user's messages, so messages from separate requests (e.g. two
+        # webhooks close together) are handled one after another rather than interleaving conversation state
+        self.message_lock = asyncio.Lock()
 
         self.rag_state = {
             "enabled": False,
@@ -33,7 +66,7 @@ class BotHandler:
         }
 
         self.crm_state = { # Renamed from zoho_state for agnosticism
-            "state": STATE_INITIAL,
+            "state": ConversationState.INITIAL,
             "name": None, # Full name provided by user
             "email": None,
             "phone": user_id, # WhatsApp user ID is used as phone for initial search
@@ -41,18 +74,61 @@ class BotHandler:
             "lead_found_name": None # Name of lead found in CRM
         }
 
+        # Command word -> handler; each handler receives the rest of the message as its argument
+        self._command_handlers = {
+            "/reset": self._cmd_reset,
+            "/set_llm": self._cmd_set_llm,
+            "/enable_rag": self._cmd_enable_rag,
+            "/disable_rag": self._cmd_disable_rag,
+        }
+
         self.lead_parser = LeadParser()
         try:
-            # Pass the active_tenant_config to CRMRouter
-            self.crm_router = CRMRouter(active_tenant_config=self.active_tenant_config)
+            # Share the tenant's CRMRouter (and its CRM client) with its other users
+            self.crm_router = CRMRouter.for_tenant(self.active_tenant_config)
         except (FileNotFoundError, ValueError, RuntimeError) as e:
             logger.error(f"Failed to initialize CRMRouter for tenant {self.active_tenant_config.get('tenant_id', 'N/A')}: {e}")
             self.crm_router = None # Indicate that CRM is not available
             print(f"[BotHandler ERROR] CRM integration not available due to: {e}")
 
-    def _get_llm_response(self, user_query: str, context: str = None) -> str:
+        # Background CRM search for this user's phone, started on their first message and consumed by /set_llm
+        self._lead_lookup = None
+
+    def _prefetch_lead(self) -> None:
+        """
+        Starts the CRM lead search for this user's phone in the background, so the result is usually ready by the
+        time /set_llm needs it. Only done while the user is still in the INITIAL state and no search is pending;
+        repeat searches are served by the CRM router's search cache.
+        """
+        if not self.crm_router or self._lead_lookup is not None or self.crm_state['state'] != ConversationState.INITIAL:
+            return
+        self._lead_lookup = asyncio.create_task(self.crm_router.async_search_lead(self.crm_state['phone']))
+        self._lead_lookup.add_done_callback(self._log_lead_lookup_failure)
+
+    def _log_lead_lookup_failure(self, lead_lookup: asyncio.Task) -> None:
+        """Retrieves and logs a failed background lead search, which /set_llm may never await."""
+        if not lead_lookup.cancelled() and lead_lookup.exception():
+            logger.warning(f"Background CRM lead search failed for user {self.user_id}: {lead_lookup.exception()}")
+
+    async def _get_lead_record(self) -> dict | None:
+        """Returns the CRM lead record for this user's phone (prefetched if possible), or None if not found."""
+        lead_lookup, self._lead_lookup = self._lead_lookup, None
+        try:
+            if lead_lookup is not None:
+                return await lead_lookup
+            return await self.crm_router.async_search_lead(self.crm_state['phone'])
+        except Exception as e:
+            logger.error(f"CRM lead search failed for user {self.user_id}: {e}")
+            return None
+
+    async def _get_llm_response(self, user_query: str, context: str = None, ephemeral_query: bool = False) -> str:
         """
         Helper to get response from chosen LLM, with enhanced error handling.
+        Args:
+            user_query (str): The current user query.
+            context (str, optional): RAG context to send along with the query.
+            ephemeral_query (bool): If True, user_query is an internal prompt that is sent with the history for
+                this call only and never stored in it; only the model's reply is kept.
         Returns:
             str: The LLM's response or an error message.
         """
@@ -66,10 +142,26 @@ class BotHandler:
         # as the last message. So, we don't append it here.
         # The bot.get_response method is expected to handle the context augmentation internally.
 
-        logger.debug(f"[DEBUG] _get_llm_response: History being sent to LLM: {json.dumps(self.session.get_history(), indent=2)}")
+        history = self.session.get_history()
+        llm_history = self.session.get_history(bot_instance.history_format)
+        if ephemeral_query:
+            prompt_session = ChatSession() # Formats the prompt the same way as stored messages
+            prompt_session.add_message("user", user_query)
+            history += prompt_session.get_history()
+            llm_history += prompt_session.get_history(bot_instance.history_format)
+
+        if logger.isEnabledFor(logging.DEBUG): # Skip serializing the whole history unless it will be logged
+            logger.debug(f"[DEBUG] _get_llm_response: History being sent to LLM: {orjson.dumps(history, option=orjson.OPT_INDENT_2).decode()}")
+
+        cache_key = _response_cache_key(llm_type, history, context)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached:
+            logger.debug(f"Response cache hit for user {self.user_id} ({llm_type}), saved {cached[1] + cached[2]} tokens.")
+            self.session.add_message("model", cached[0])
+            return cached[0]
 
         try:
-            response_tuple = bot_instance.get_response(self.session.get_history(), context=context)
+            response_tuple = await bot_instance.get_response(llm_history, context=context)
 
             # Check if the response is in the expected (text, duration, in_tokens, out_tokens, error) format
             if isinstance(response_tuple, tuple) and len(response_tuple) == 5:
@@ -83,6 +175,8 @@ class BotHandler:
                 if not response_text:
                     return f"I'm sorry, {llm_type.upper()} did not provide a response. Could you please try again?"
 
+                _RESPONSE_CACHE.set(cache_key, (response_text, response_tuple[2], response_tuple[3]))
+
                 # Add bot's response to history
                 self.session.add_message("model", response_text)
                 return response_text
@@ -99,7 +193,7 @@ class BotHandler:
             logger.error(f"An unexpected error occurred while getting LLM ({llm_type}) response: {e}")
             return f"I'm really sorry, but I'm having trouble connecting with {llm_type.upper()} right now. Please try again in a moment."
 
-    def _personalize_greeting(self, lead_name: str) -> str:
+    async def _personalize_greeting(self, lead_name: str) -> str:
         """Generates a personalized greeting using LLM."""
         llm_type = self._current_llm
         if not llm_type:
@@ -109,13 +203,22 @@ class BotHandler:
         personal_prompt = f"The user's name is {lead_name}. Greet them warmly and ask how you can help them today. Keep it concise."
 
         # For a one-off prompt like this, we can use a temporary history
-        temp_history = [{'role': 'user', 'content': personal_prompt}]
+        temp_session = ChatSession()
+        temp_session.add_message('user', personal_prompt)
+
+        # The prompt only depends on lead_name, so returning users get their greeting from the cache
+        cache_key = _response_cache_key(llm_type, temp_session.get_history(), None)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached:
+            return cached[0]
 
         try:
-            response_tuple = bot_instance.get_response(temp_history) # Pass temporary history
+            response_tuple = await bot_instance.get_response(temp_session.get_history(bot_instance.history_format)) # Pass temporary history
             if isinstance(response_tuple, tuple) and len(response_tuple) == 5:
                 response_text = response_tuple[0]
                 error = response_tuple[4]
+                if response_text and not error:
+                    _RESPONSE_CACHE.set(cache_key, (response_text, response_tuple[2], response_tuple[3]))
             else:
                 response_text = response_tuple
                 error = None
@@ -126,81 +229,91 @@ class BotHandler:
             return f"Welcome back, {lead_name}! How can I assist you today?"
 
 
-    def handle_message(self, user_message: str) -> str:
+    # --- Core commands (always available) ---
+    async def _cmd_reset(self, argument: str) -> str:
+        """Clears the conversation, LLM choice, RAG and CRM state."""
+        self.session.clear_history()
+        self._current_llm = None
+        self.rag_state = {"enabled": False, "url": None, "vector_store": None, "awaiting_url": False}
+        self.crm_state = {
+            "state": ConversationState.INITIAL, "name": None, "email": None,
+            "phone": self.user_id, "lead_id": None, "lead_found_name": None
+        }
+        return "Chat reset. Please use /set_llm to choose an LLM."
+
+    async def _cmd_set_llm(self, argument: str) -> str:
+        """Selects the LLM and looks the user up in the CRM to decide how to greet them."""
+        llm_type = argument.strip()
+        if llm_type in ("gemini", "ollama"):
+            self._current_llm = llm_type
+
+            if self.crm_router: # Check if CRM Router was successfully initialized
+                lead_record = await self._get_lead_record()
+            else:
+                lead_record = None
+                logger.warning("CRM Router not initialized, skipping lead search.")
+
+            if lead_record:
+                self.crm_state['state'] = ConversationState.LEAD_COLLECTED
+                self.crm_state['lead_id'] = lead_record.get('id')
+                self.crm_state['lead_found_name'] = lead_record['display_name'] # Set by CRMRouter for any CRM
+
+                personalized_greeting = await self._personalize_greeting(self.crm_state['lead_found_name'])
+                return f"You've selected {self._current_llm.upper()}. {personalized_greeting}"
+            else:
+                self.crm_state['state'] = ConversationState.AWAITING_NAME
+                return f"You've selected {self._current_llm.upper()}. Hello! Before we proceed, could you please tell me your full name?"
+        return "Invalid LLM choice. Please use /set_llm gemini or /set_llm ollama."
+
+    async def _cmd_enable_rag(self, argument: str) -> str:
+        """Asks the user for the URL to use for Web RAG."""
+        if self.rag_state["enabled"]:
+            return f"Web RAG is already enabled using {self.rag_state['url']}. Use /disable_rag to change it."
+        self.rag_state["awaiting_url"] = True # Use this flag as the state
+        self.crm_state['state'] = ConversationState.RAG_AWAITING_URL # Set main state for clarity
+        return "Please reply to this message with the URL you want to use for Web RAG. For example: https://www.example.com"
+
+    async def _cmd_disable_rag(self, argument: str) -> str:
+        """Turns Web RAG off for this session."""
+        if self.rag_state["enabled"]:
+            self.rag_state = {"enabled": False, "url": None, "vector_store": None, "awaiting_url": False}
+            # Reset main state if it was RAG awaiting URL
+            if self.crm_state['state'] == ConversationState.RAG_AWAITING_URL:
+                self.crm_state['state'] = ConversationState.LEAD_COLLECTED if self.crm_state['lead_id'] else ConversationState.INITIAL
+            return "Web RAG has been disabled for this session."
+        return "Web RAG is not currently enabled."
+
+    async def handle_message(self, user_message: str) -> str:
         """
         Processes an incoming user message based on conversation state.
+        Blocking CRM and RAG calls run in worker threads so the event loop keeps serving other users.
         Returns the bot's response.
         """
-        logger.info(f"User {self.user_id} (State: {self.crm_state['state']}) received: {user_message}")
+        logger.info(f"User {self.user_id} (State: {self.crm_state['state'].name}) received: {user_message}")
+        self._prefetch_lead()
 
         # --- Handle core commands first (always available) ---
-        if user_message.lower() == "/reset":
-            self.session.clear_history()
-            self._current_llm = None
-            self.rag_state = {"enabled": False, "url": None, "vector_store": None, "awaiting_url": False}
-            self.crm_state = {
-                "state": STATE_INITIAL, "name": None, "email": None,
-                "phone": self.user_id, "lead_id": None, "lead_found_name": None
-            }
-            return "Chat reset. Please use /set_llm to choose an LLM."
-
-        elif user_message.lower().startswith("/set_llm "):
-            parts = user_message.lower().split()
-            if len(parts) == 2 and parts[1] in ["gemini", "ollama"]:
-                self._current_llm = parts[1]
-
-                if self.crm_router: # Check if CRM Router was successfully initialized
-                    lead_record = self.crm_router.search_lead(self.crm_state['phone'])
-                else:
-                    lead_record = None
-                    logger.warning("CRM Router not initialized, skipping lead search.")
-
-                if lead_record:
-                    self.crm_state['state'] = STATE_LEAD_COLLECTED
-                    self.crm_state['lead_id'] = lead_record.get('id')
-                    # Use common keys from normalized data if available, otherwise CRM-specific
-                    # HubSpot uses 'firstname', 'lastname'; Zoho uses 'First_Name', 'Last_Name', 'Full_Name'
-                    self.crm_state['lead_found_name'] = lead_record.get('Full_Name') or \
-                                                         lead_record.get('firstname') or \
-                                                         lead_record.get('First_Name') or \
-                                                         "valued customer" # Fallback
-
-                    # Add a dummy user message to history to prime the LLM for greeting
-                    self.session.add_message("user", "Start conversation with a greeting.")
-                    personalized_greeting = self._personalize_greeting(self.crm_state['lead_found_name'])
-                    return f"You've selected {self._current_llm.upper()}. {personalized_greeting}"
-                else:
-                    self.crm_state['state'] = STATE_AWAITING_NAME
-                    return f"You've selected {self._current_llm.upper()}. Hello! Before we proceed, could you please tell me your full name?"
-            return "Invalid LLM choice. Please use /set_llm gemini or /set_llm ollama."
-
-        elif user_message.lower() == "/enable_rag":
-            if self.rag_state["enabled"]:
-                return f"Web RAG is already enabled using {self.rag_state['url']}. Use /disable_rag to change it."
-            self.rag_state["awaiting_url"] = True # Use this flag as the state
-            self.crm_state['state'] = STATE_RAG_AWAITING_URL # Set main state for clarity
-            return "Please reply to this message with the URL you want to use for Web RAG. For example: https://www.example.com"
-
-        elif user_message.lower() == "/disable_rag":
-            if self.rag_state["enabled"]:
-                self.rag_state = {"enabled": False, "url": None, "vector_store": None, "awaiting_url": False}
-                # Reset main state if it was RAG awaiting URL
-                if self.crm_state['state'] == STATE_RAG_AWAITING_URL:
-                    self.crm_state['state'] = STATE_LEAD_COLLECTED if self.crm_state['lead_id'] else STATE_INITIAL
-                return "Web RAG has been disabled for this session."
-            return "Web RAG is not currently enabled."
+        command, _, argument = user_message.lower().partition(" ")
+        command_handler = self._command_handlers.get(command)
+        if command_handler:
+            return await command_handler(argument)
 
         # --- Handle Web RAG URL input ---
-        if self.rag_state["awaiting_url"] and self.crm_state['state'] == STATE_RAG_AWAITING_URL:
+        if self.rag_state["awaiting_url"] and self.crm_state['state'] == ConversationState.RAG_AWAITING_URL:
             url = user_message.strip()
             self.rag_state["awaiting_url"] = False # Reset flag
 
             # Reset main state to normal chat after URL is provided
-            self.crm_state['state'] = STATE_LEAD_COLLECTED if self.crm_state['lead_id'] else STATE_INITIAL
+            self.crm_state['state'] = ConversationState.LEAD_COLLECTED if self.crm_state['lead_id'] else ConversationState.INITIAL
+
+            # Reject malformed input up front instead of spending a failed crawl on it
+            if not _URL_RE.match(url):
+                return f"'{url}' doesn't look like a valid http(s) URL. Web RAG remains disabled; use /enable_rag to try again."
 
             response_message = f"Processing content from {url} for RAG. This might take a moment..."
 
-            vector_store, error = create_vector_store_from_web(url)
+            # Shared with every other user of this tenant who loaded the same URL
+            vector_store, error = await get_vector_store_for_url(url, self.active_tenant_config.get('tenant_id'))
             if vector_store:
                 self.rag_state["enabled"] = True
                 self.rag_state["url"] = url
@@ -213,14 +326,14 @@ class BotHandler:
                 return f"{response_message}\nFailed to load knowledge base from {url}: {error}. Web RAG remains disabled."
 
         # --- Zoho Lead Capture Flow (now uses LeadParser and CRMRouter) ---
-        if self.crm_state['state'] == STATE_AWAITING_NAME:
+        if self.crm_state['state'] == ConversationState.AWAITING_NAME:
             full_name = user_message.strip()
             self.crm_state['name'] = full_name
 
-            self.crm_state['state'] = STATE_AWAITING_EMAIL
+            self.crm_state['state'] = ConversationState.AWAITING_EMAIL
             return f"Thanks, {self.crm_state['name']}! Now, please provide your email address."
 
-        elif self.crm_state['state'] == STATE_AWAITING_EMAIL:
+        elif self.crm_state['state'] == ConversationState.AWAITING_EMAIL:
             self.crm_state['email'] = user_message.strip()
 
             # Use LeadParser to normalize data
@@ -232,20 +345,19 @@ class BotHandler:
 
             # Use CRMRouter to create lead
             if self.crm_router:
-                created_lead_details = self.crm_router.create_lead(normalized_data)
+                created_lead_details = await self.crm_router.async_create_lead(normalized_data)
             else:
                 created_lead_details = None
                 logger.error("CRM Router not initialized, cannot create lead.")
 
 
             if created_lead_details:
+                self._lead_lookup = None # A pending search predates this lead
                 self.crm_state['lead_id'] = created_lead_details.get('id')
-                self.crm_state['state'] = STATE_LEAD_COLLECTED
+                self.crm_state['state'] = ConversationState.LEAD_COLLECTED
 
                 # Use the normalized first/last name for the confirmation message
-                display_name = normalized_data.get('first_name')
-                if normalized_data.get('last_name'):
-                    display_name += f" {normalized_data['last_name']}"
+                display_name = normalized_data['display_name']
 
                 confirmation_message_prompt = (
                     f"A new lead has been created for {display_name} "
@@ -254,22 +366,40 @@ class BotHandler:
                     f"thanking them and asking how you can help them now. "
                     f"Keep it concise and friendly."
                 )
-                # Add user message to history before getting LLM response
-                self.session.add_message("user", confirmation_message_prompt)
-                return self._get_llm_response(confirmation_message_prompt)
+                # The prompt is an instruction to the LLM, not something the user said, so it isn't kept in history
+                return await self._get_llm_response(confirmation_message_prompt, ephemeral_query=True)
             else:
-                self.crm_state['state'] = STATE_INITIAL
+                self.crm_state['state'] = ConversationState.INITIAL
                 return "I apologize, but there was an issue creating your lead in our system. Please try again or contact support."
 
         # --- Normal Chat with RAG and LLM ---
         context = None
-        if self.rag_state["enabled"] and self.rag_state["vector_store"]:
-            context = retrieve_context_from_vector_store(self.rag_state["vector_store"], user_message)
+        query_embedding = None
+        # Small talk like "hi" or "thanks" skips the embedding and retrieval entirely
+        if self.rag_state["enabled"] and self.rag_state["vector_store"] and needs_context(user_message):
+            vector_store = self.rag_state["vector_store"]
+            cache_namespace = answer_namespace(self.active_tenant_config.get('tenant_id'), self.user_id,
+                                               self._current_llm, self.rag_state['url'])
+            query_embedding = await run_in_rag_executor(embed_query, vector_store, user_message)
+            if query_embedding is not None and self._current_llm:
+                cached_response = _SEMANTIC_CACHE.get(cache_namespace, query_embedding)
+                if cached_response:
+                    logger.info(f"Semantic cache hit for user {self.user_id} on {self.rag_state['url']}.")
+                    self.session.add_message("user", user_message)
+                    self.session.add_message("model", cached_response)
+                    return cached_response
+
+            context = await run_in_rag_executor(retrieve_context_from_vector_store, vector_store, user_message,
+                                                query_embedding=query_embedding)
             if not context:
                 logger.info(f"No relevant context found for user {self.user_id} from the URL.")
                 pass # LLM will handle lack of context
 
         self.session.add_message("user", user_message) # Add user message to history before getting LLM response
-        response_text = self._get_llm_response(user_message, context=context)
+        response_text = await self._get_llm_response(user_message, context=context)
+
+        # _get_llm_response only adds the reply to history when the LLM answered successfully
+        if query_embedding is not None and self.session.get_history()[-1]['role'] == "model":
+            _SEMANTIC_CACHE.set(cache_namespace, query_embedding, response_text)
         return response_text
 
@@ -1,11 +1,20 @@
+from collections import deque
+
 class ChatSession:
     """
     Manages the conversation history for a chatbot session.
-    History is stored as a list of dictionaries, suitable for LLM APIs.
+    History is stored as a sequence of dictionaries, suitable for LLM APIs. Only the most recent
+    max_messages are kept, which bounds the prompt sent to the LLM on every turn.
     Example: [{'role': 'user', 'content': 'Hello'}, {'role': 'model', 'content': 'Hi there!'}]
+    Gemini- and Ollama-formatted views of the same history are kept alongside it, so the bots don't
+    have to convert the whole conversation on every turn.
     """
-    def __init__(self):
-        self.history = []
+    __slots__ = ("max_messages", "history", "_views")
+
+    def __init__(self, max_messages: int = 64):
+        self.max_messages = max_messages
+        self.history = deque(maxlen=max_messages)
+        self._views = {"gemini": deque(maxlen=max_messages), "ollama": deque(maxlen=max_messages)}
 
     def add_message(self, role: str, content: str):
         """
@@ -15,19 +24,28 @@ class ChatSession:
             content (str): The text content of the message.
         """
         self.history.append({'role': role, 'content': content})
+        self._views["gemini"].append({'role': role, 'parts': [{'text': content}]})
+        # Ollama calls the model role 'assistant'
+        self._views["ollama"].append({'role': 'assistant' if role == 'model' else role, 'content': content})
 
-    def get_history(self) -> list:
+    def get_history(self, history_format: str = None) -> list:
         """
         Returns the current chat history.
+        Args:
+            history_format (str, optional): 'gemini' or 'ollama' to get the history in that LLM's message format.
         Returns:
             list: A list of message dictionaries.
         """
-        return self.history
+        if history_format:
+            return list(self._views[history_format])
+        return list(self.history)
 
     def clear_history(self):
         """
         Clears the entire chat history.
         """
-        self.history = []
+        self.history.clear()
+        for view in self._views.values():
+            view.clear()
         print("[Chat history cleared.]")
 
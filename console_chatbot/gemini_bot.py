@@ -9,6 +9,8 @@ class GeminiBot:
     Handles interactions with the Gemini 1.5 Flash API.
     Manages API key configuration and response generation with chat history.
     """
+    history_format = "gemini" # Message format this bot expects from ChatSession.get_history
+
     def __init__(self, model_name='gemini-1.5-flash'):
         self.model_name = model_name
         self.model = None
@@ -24,6 +26,8 @@ class GeminiBot:
             if not api_key:
                 raise ValueError("GEMINI_API_KEY not found in environment variables. Please check your .env file in the project root.")
 
+            # The default gRPC transport keeps one long-lived HTTP/2 channel per client and multiplexes
+            # every request over it, so calls don't pay a new TLS handshake. Keep this single model instance.
             genai.configure(api_key=api_key)
             self.model = genai.GenerativeModel(self.model_name)
             print(f"[Gemini 1.5 Flash bot initialized.]")
@@ -34,12 +38,51 @@ class GeminiBot:
             print(f"An unexpected error occurred during Gemini API configuration: {e}")
             self.model = None
 
-    def get_response(self, chat_history: list, context: str = None) -> tuple[str, float, int, int, str | None]:
+    async def _count_tokens_fallback(self, messages_for_llm: list, response_text: str = None) -> tuple[int, int]:
+        """
+        Counts tokens with count_tokens RPCs, for SDK versions whose responses have no usage_metadata.
+        Args:
+            messages_for_llm (list): The messages sent to the model.
+            response_text (str, optional): The model's reply, if there is one.
+        Returns:
+            tuple: (input_tokens, output_tokens)
+        """
+        input_tokens = 0
+        output_tokens = 0
+        if messages_for_llm:
+            try:
+                # count_tokens accepts the same dict messages as generate_content, so no Content/Part rebuild is needed
+                input_tokens_response = await self.model.count_tokens_async(messages_for_llm)
+                input_tokens = input_tokens_response.total_tokens if hasattr(input_tokens_response, 'total_tokens') else 0
+            except Exception as token_e:
+                print(f"[WARNING] Error counting input tokens for Gemini: {token_e}")
+        if response_text:
+            try:
+                output_tokens_response = await self.model.count_tokens_async([{'role': 'model', 'parts': [{'text': response_text}]}])
+                output_tokens = output_tokens_response.total_tokens if hasattr(output_tokens_response, 'total_tokens') else 0
+            except Exception as token_e:
+                print(f"[WARNING] Error counting output tokens for Gemini: {token_e}")
+        return input_tokens, output_tokens
+
+    def _build_messages(self, chat_history: list, context: str = None) -> list:
+        """
+        Builds the message list sent to Gemini.
+        chat_history is already in Gemini's format and ends with the current user query;
+        only that last message needs rebuilding when context is added. The context and the query
+        go in as separate parts so the (often multi-KB) context is never copied into a new string.
+        """
+        if context:
+            final_user_parts = [{'text': "Context:"}, {'text': context}, {'text': "Question:"}, *chat_history[-1]['parts']]
+            return chat_history[:-1] + [{'role': 'user', 'parts': final_user_parts}]
+        return chat_history
+
+    async def get_response(self, chat_history: list, context: str = None) -> tuple[str, float, int, int, str | None]:
         """
         Gets a response from the Gemini model based on the provided chat history and optional context.
+        Uses the SDK's async calls so concurrent users don't block each other while waiting on the API.
         Args:
-            chat_history (list): A list of message dictionaries representing the conversation.
-            context (str, optional): Additional context to prepend to the last user message.
+            chat_history (list): The conversation in Gemini's message format (see ChatSession.get_history), ending with the user's query.
+            context (str, optional): Additional context to send ahead of the last user message.
         Returns:
             tuple: (response_text, duration_seconds, input_tokens, output_tokens, error_message)
         """
@@ -48,61 +91,22 @@ class GeminiBot:
 
         start_time = time.time() # Start timer
         try:
-            # Prepare the messages list for the LLM
-            messages_for_llm = []
-
-            # Add all historical messages except the very last one (which is the current user query)
-            # We assume chat_history already has the current user message as the last entry
-            historical_messages = chat_history[:-1] # All messages except the last user query
-
-            for msg in historical_messages:
-                messages_for_llm.append({'role': msg['role'], 'parts': [{'text': msg['content']}]})
-
-            # Get the current user's actual query
-            current_user_query = chat_history[-1]['content']
-
-            # Construct the final user message with context if provided
-            if context:
-                final_user_message_content = f"Context: {context}\n\nQuestion: {current_user_query}"
-            else:
-                final_user_message_content = current_user_query
-
-            messages_for_llm.append({'role': 'user', 'parts': [{'text': final_user_message_content}]})
-
-            print("\n[DEBUG] Messages sent to Gemini LLM:")
-            for msg in messages_for_llm:
-                print(f"  Role: {msg['role']}, Content: {msg['parts'][0]['text'][:100]}...") # Print first 100 chars
-            print("[DEBUG] End LLM messages.\n")
-
-            # Count tokens for the input prompt
-            input_tokens = 0
-            try:
-                # Gemini's count_tokens expects a list of Content objects, not raw dicts
-                # Reconstruct content objects for token counting
-                contents_for_token_count = []
-                for msg in messages_for_llm:
-                    parts = [genai.types.Part(text=p['text']) for p in msg['parts']]
-                    contents_for_token_count.append(genai.types.Content(role=msg['role'], parts=parts))
-
-                input_tokens_response = self.model.count_tokens(contents_for_token_count)
-                input_tokens = input_tokens_response.total_tokens if hasattr(input_tokens_response, 'total_tokens') else 0
-            except Exception as token_e:
-                print(f"[WARNING] Error counting input tokens for Gemini: {token_e}")
-
+            messages_for_llm = self._build_messages(chat_history, context)
 
-            response = self.model.generate_content(messages_for_llm)
+            response = await self.model.generate_content_async(messages_for_llm)
 
             end_time = time.time() # End timer
             duration = end_time - start_time
 
-            if response.text:
-                output_tokens = 0
-                try:
-                    output_tokens_response = self.model.count_tokens([genai.types.Content(role="model", parts=[genai.types.Part(text=response.text)])])
-                    output_tokens = output_tokens_response.total_tokens if hasattr(output_tokens_response, 'total_tokens') else 0
-                except Exception as token_e:
-                    print(f"[WARNING] Error counting output tokens for Gemini: {token_e}")
+            # generate_content already reports token usage, so no extra count_tokens round-trips are needed
+            usage_metadata = getattr(response, 'usage_metadata', None)
+            if usage_metadata:
+                input_tokens = usage_metadata.prompt_token_count
+                output_tokens = usage_metadata.candidates_token_count
+            else:
+                input_tokens, output_tokens = await self._count_tokens_fallback(messages_for_llm, response.text)
 
+            if response.text:
                 return response.text, duration, input_tokens, output_tokens, None
             else:
                 return "No text response received from Gemini.", duration, input_tokens, 0, "No text response"
@@ -111,3 +115,25 @@ class GeminiBot:
             duration = end_time - start_time
             return f"Error communicating with Gemini: {e}", duration, 0, 0, str(e)
 
+    async def stream_response(self, chat_history: list, context: str = None):
+        """
+        Streams the Gemini reply as it is generated, so callers can show text before the whole answer is ready.
+        Args:
+            chat_history (list): The conversation in Gemini's message format (see ChatSession.get_history), ending with the user's query.
+            context (str, optional): Additional context to send ahead of the last user message.
+        Yields:
+            str: The next piece of the reply.
+        Raises:
+            RuntimeError: If the Gemini model is not configured.
+        """
+        if self.model is None:
+            raise RuntimeError("Gemini model is not configured. Please check your API key in the .env file.")
+
+        response = await self.model.generate_content_async(self._build_messages(chat_history, context), stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError: # Chunks without text parts (e.g. only a finish reason)
+                continue
+            if text:
+                yield text
@@ -0,0 +1,49 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gemini_bot import GeminiBot
+from ollama_bot import OllamaBot
+
+# How to build each LLM bot, by the name users pick with /set_llm
+LLM_BOT_FACTORIES = {
+    "gemini": GeminiBot,
+    "ollama": OllamaBot,
+}
+
+class LazyLLMBots(dict):
+    """
+    Maps LLM names to bot instances, building each bot the first time it is looked up.
+    Unless it is prewarmed, a process where every user picks Ollama never configures Gemini, and vice versa.
+    The bots are shared by all users, so each one is still built at most once.
+    """
+    def __init__(self):
+        super().__init__()
+        # One lock per bot, so a lookup racing a background prewarm() never builds the same bot twice
+        self._build_locks = {llm_type: threading.Lock() for llm_type in LLM_BOT_FACTORIES}
+
+    def __missing__(self, llm_type: str):
+        with self._build_locks[llm_type]:
+            if llm_type not in self:
+                self[llm_type] = LLM_BOT_FACTORIES[llm_type]()
+            return dict.__getitem__(self, llm_type)
+
+    def prewarm(self, llm_types=None) -> None:
+        """
+        Builds the given bots (default: all of them) at the same time, so startup waits for the slowest
+        bot rather than the sum of all of them and the first user of each LLM doesn't pay for building it.
+        Args:
+            llm_types (iterable[str], optional): Names from LLM_BOT_FACTORIES to build.
+        """
+        llm_types = [llm_type for llm_type in (LLM_BOT_FACTORIES if llm_types is None else llm_types) if llm_type not in self]
+        if llm_types:
+            with ThreadPoolExecutor(max_workers=len(llm_types)) as pool:
+                list(pool.map(self.__getitem__, llm_types))
+
+    def prewarm_in_background(self) -> None:
+        """
+        Starts prewarm() on a background thread for the bots named in the PREWARM_LLMS environment variable
+        (comma-separated, default: all bots), so startup isn't held up by it. PREWARM_LLMS="" disables it.
+        """
+        llm_types = [name.strip() for name in os.getenv("PREWARM_LLMS", ",".join(LLM_BOT_FACTORIES)).split(",")
+                     if name.strip() in LLM_BOT_FACTORIES]
+        threading.Thread(target=self.prewarm, args=(llm_types,), name="llm-prewarm", daemon=True).start()
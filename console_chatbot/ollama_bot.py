@@ -1,4 +1,7 @@
+import asyncio
+import httpx
 import ollama
+import os
 import time # NEW: Import time for duration tracking
 
 class OllamaBot:
@@ -6,49 +9,60 @@ class OllamaBot:
     Handles interactions with a local Ollama model (e.g., phi3:mini).
     Manages model initialization and response generation with chat history.
     """
-    def __init__(self, model_name='phi3:mini'):
+    history_format = "ollama" # Message format this bot expects from ChatSession.get_history
+
+    def __init__(self, model_name='phi3:mini', keep_alive='30m', host=None, timeout=120.0):
         self.model_name = model_name
+        # Ollama reuses the KV cache of the longest prompt prefix it has already processed, so every turn only
+        # prefills what changed since the last one. That cache is lost when the model is unloaded after
+        # the server's default 5 minutes idle; keep_alive keeps the model (and its cached prefix) resident.
+        self.keep_alive = keep_alive
+        # One async client per bot, so its pooled keep-alive connections are reused for every user instead of
+        # reconnecting per message. Concurrent requests are only processed in parallel by the server
+        # if it is started with OLLAMA_NUM_PARALLEL > 1.
+        self.client = ollama.AsyncClient(
+            host=host or os.getenv("OLLAMA_HOST"),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+        # The server decodes up to OLLAMA_NUM_PARALLEL requests together in one batch. Holding any extra
+        # requests here, rather than letting them queue inside Ollama, means the client timeout only covers
+        # actual generation and each freed slot is refilled straight away.
+        self._parallel_slots = asyncio.Semaphore(int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
         print(f"[Ollama bot initialized with model: {self.model_name}]")
 
-    def get_response(self, chat_history: list, context: str = None) -> tuple[str, float, int, int, str | None]:
+    def _build_messages(self, chat_history: list, context: str = None) -> list:
+        """
+        Builds the message list sent to Ollama.
+        chat_history is already in Ollama's format and ends with the current user query. Context goes in
+        as its own system message just before it, so the (often multi-KB) context is never copied into
+        a new string and the stored query message is sent unchanged.
+        """
+        if context:
+            context_messages = [
+                {'role': 'system', 'content': "Use the following context to answer the user's next question."},
+                {'role': 'system', 'content': context},
+            ]
+            return chat_history[:-1] + context_messages + chat_history[-1:]
+        return chat_history
+
+    async def get_response(self, chat_history: list, context: str = None) -> tuple[str, float, int, int, str | None]:
         """
         Gets a response from the Ollama model based on the provided chat history and optional context.
+        Uses the async client so concurrent users don't block each other while the model generates.
         Args:
-            chat_history (list): A list of message dictionaries representing the conversation.
-            context (str, optional): Additional context to prepend to the last user message.
+            chat_history (list): The conversation in Ollama's message format (see ChatSession.get_history), ending with the user's query.
+            context (str, optional): Additional context to send ahead of the last user message.
         Returns:
             tuple: (response_text, duration_seconds, input_tokens, output_tokens, error_message)
         """
         start_time = time.time() # Start timer
         try:
-            # Prepare the messages list for the LLM
-            messages_for_llm = []
-
-            # Add all historical messages except the very last one (which is the current user query)
-            historical_messages = chat_history[:-1]
-
-            for msg in historical_messages:
-                # Map 'model' to 'assistant' for Ollama
-                role = 'assistant' if msg['role'] == 'model' else msg['role']
-                messages_for_llm.append({'role': role, 'content': msg['content']})
-
-            # Get the current user's actual query
-            current_user_query = chat_history[-1]['content']
+            messages_for_llm = self._build_messages(chat_history, context)
 
-            # Construct the final user message with context if provided
-            if context:
-                final_user_message_content = f"Context: {context}\n\nQuestion: {current_user_query}"
-            else:
-                final_user_message_content = current_user_query
-
-            messages_for_llm.append({'role': 'user', 'content': final_user_message_content})
-
-            print("\n[DEBUG] Messages sent to Ollama LLM:")
-            for msg in messages_for_llm:
-                print(f"  Role: {msg['role']}, Content: {msg['content'][:100]}...") # Print first 100 chars
-            print("[DEBUG] End LLM messages.\n")
-
-            response = ollama.chat(model=self.model_name, messages=messages_for_llm, options={'num_predict': 4000}) # Added num_predict for token limit
+            async with self._parallel_slots:
+                response = await self.client.chat(model=self.model_name, messages=messages_for_llm, options={'num_predict': 4000}, # Added num_predict for token limit
+                                                  keep_alive=self.keep_alive)
 
             end_time = time.time() # End timer
             duration = end_time - start_time
@@ -71,3 +85,19 @@ class OllamaBot:
             duration = end_time - start_time
             return f"An unexpected error occurred with Ollama: {e}", duration, 0, 0, str(e)
 
+    async def stream_response(self, chat_history: list, context: str = None):
+        """
+        Streams the Ollama reply as it is generated, so callers can show text before the whole answer is ready.
+        Args:
+            chat_history (list): The conversation in Ollama's message format (see ChatSession.get_history), ending with the user's query.
+            context (str, optional): Additional context to send ahead of the last user message.
+        Yields:
+            str: The next piece of the reply.
+        """
+        async with self._parallel_slots:
+            stream = await self.client.chat(model=self.model_name, messages=self._build_messages(chat_history, context),
+                                            options={'num_predict': 4000}, keep_alive=self.keep_alive, stream=True)
+            async for part in stream:
+                content = part['message']['content']
+                if content:
+                    yield content
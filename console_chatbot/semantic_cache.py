@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+def answer_namespace(tenant_id, user_id, llm_type: str, url: str) -> str:
+    """
+    Returns the namespace for a RAG answer. Answers are generated from the asking user's whole chat history
+    (which may hold their name, email and earlier replies), so they are only ever reused for that same user,
+    never served to another one; tenants and LLMs are kept apart too.
+    """
+    return f"{tenant_id}|{user_id}|{llm_type}|{url}"
+
+class SemanticCache:
+    """
+    Caches answers by meaning rather than exact text: a query whose embedding has a cosine similarity
+    of at least `threshold` with a cached query gets the cached answer.
+    Entries are grouped by namespace (e.g. the RAG source URL), expire after `ttl` seconds, and once a
+    namespace holds `maxsize` entries the least recently used one is replaced.
+    """
+    def __init__(self, threshold: float = 0.95, maxsize: int = 512, ttl: float = 3600, max_namespaces: int = None):
+        """
+        Args:
+            threshold (float): Minimum cosine similarity for a cached answer to be reused.
+            maxsize (int): Maximum number of entries per namespace.
+            ttl (float): Seconds an entry stays valid after it was stored.
+            max_namespaces (int, optional): Maximum number of namespaces kept; beyond it the least recently used
+                namespace is dropped whole. Unbounded by default.
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_namespaces = max_namespaces
+        # {namespace: {"vectors": (n, dim) array, "values": list, "expires": (n,) array, "used": (n,) array}},
+        # least recently used namespace first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """Returns the embedding as a unit-length float32 vector, so a dot product is the cosine similarity."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, namespace: str, embedding):
+        """
+        Looks up the closest cached query in the namespace.
+        Args:
+            namespace (str): The group the query belongs to.
+            embedding (list[float]): The query's embedding.
+        Returns:
+            The cached answer if a close enough, unexpired query exists, otherwise None.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            bucket = self._buckets.get(namespace)
+            if not bucket or bucket["vectors"].shape[1] != vector.size:
+                return None
+            self._buckets.move_to_end(namespace)
+
+            now = time.monotonic()
+            scores = bucket["vectors"] @ vector
+            scores[bucket["expires"] <= now] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            bucket["used"][best] = now
+            return bucket["values"][best]
+
+    def set(self, namespace: str, embedding, value) -> None:
+        """
+        Caches an answer for the query embedding in the namespace.
+        Args:
+            namespace (str): The group the query belongs to.
+            embedding (list[float]): The query's embedding.
+            value: The answer to return for similar queries.
+        """
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(namespace)
+            if bucket is None or bucket["vectors"].shape[1] != vector.size:
+                bucket = self._buckets[namespace] = {
+                    "vectors": np.empty((0, vector.size), dtype=np.float32),
+                    "values": [],
+                    "expires": np.empty(0),
+                    "used": np.empty(0),
+                }
+                if self.max_namespaces is not None and len(self._buckets) > self.max_namespaces:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(namespace)
+
+            if len(bucket["values"]) < self.maxsize:
+                bucket["vectors"] = np.vstack([bucket["vectors"], vector])
+                bucket["values"].append(value)
+                bucket["expires"] = np.append(bucket["expires"], now + self.ttl)
+                bucket["used"] = np.append(bucket["used"], now)
+                return
+
+            # Full: reuse an expired slot if there is one, otherwise the least recently used
+            slot = int(np.argmin(np.where(bucket["expires"] <= now, -np.inf, bucket["used"])))
+            bucket["vectors"][slot] = vector
+            bucket["values"][slot] = value
+            bucket["expires"][slot] = now + self.ttl
+            bucket["used"][slot] = now
@@ -1,5 +1,10 @@
+import asyncio
+import functools
 import os
+import sys
 import logging
+import time
+import weakref
 from dotenv import load_dotenv
 
 from telegram import Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
@@ -12,46 +17,113 @@ from telegram.ext import (
     CallbackQueryHandler,
 )
 
+# Add the project root directory to the Python path for shared helpers such as 'utils.ttl_cache'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
 # Import your existing bot logic and session manager
 from chat_session import ChatSession
-from gemini_bot import GeminiBot
-from ollama_bot import OllamaBot
+from llm_bots import LazyLLMBots
+from semantic_cache import SemanticCache, answer_namespace
+from utils.log_setup import configure_logging
+from utils.ttl_cache import TTLCache
 # Import web RAG utilities if you want to include web RAG in Telegram (Optional for this exercise, but good to have)
-from web_rag_utils import create_vector_store_from_web, retrieve_context_from_vector_store
+from web_rag_utils import (close_http_session, embed_query, get_vector_store_for_url, needs_context,
+                           retrieve_context_from_vector_store, run_in_rag_executor)
 
 # Load environment variables
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Tenant this bot serves, as in the WhatsApp bot; it scopes the shared web RAG vector stores to that tenant
+BOT_ACTIVE_TENANT_ID = os.getenv("BOT_ACTIVE_TENANT_ID")
+STREAM_EDIT_INTERVAL = 1.0 # Minimum seconds between edits of a reply that is still being streamed
 
 # Set up logging for easier debugging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+configure_logging(level=logging.INFO) # Log records are written to stderr by a background thread
 logger = logging.getLogger(__name__)
 
 # --- Global Storage for User Sessions and LLM Choices ---
-# This dictionary will store a ChatSession object for each user_id
-user_sessions = {}
-# This dictionary will store the chosen LLM for each user_id
-user_llm_choice = {} # {user_id: "gemini" or "ollama"}
-# This dictionary will store the LLM bot instances (to avoid re-initializing)
-llm_bots = {
-    "gemini": GeminiBot(),
-    "ollama": OllamaBot()
-}
+# Per-user state is kept in bounded caches so a long-running bot doesn't grow without limit: a user's entry
+# is dropped after USER_STATE_TTL seconds without activity, or earlier if MAX_ACTIVE_USERS users are more recent.
+MAX_ACTIVE_USERS = 10_000
+USER_STATE_TTL = 3600
+
+def _log_user_eviction(store_name: str):
+    """Returns an eviction callback that warns when a user store runs out of room."""
+    def on_evict(user_id, value):
+        logger.warning(f"{store_name} is full ({MAX_ACTIVE_USERS} users); dropped least recently active user {user_id}.")
+    return on_evict
+
+# This cache will store a ChatSession object for each user_id
+user_sessions = TTLCache(MAX_ACTIVE_USERS, USER_STATE_TTL, sliding=True, on_evict=_log_user_eviction("user_sessions"))
+# This cache will store the chosen LLM for each user_id
+user_llm_choice = TTLCache(MAX_ACTIVE_USERS, USER_STATE_TTL, sliding=True,
+                           on_evict=_log_user_eviction("user_llm_choice")) # {user_id: "gemini" or "ollama"}
+# This dictionary will store the LLM bot instances (to avoid re-initializing); each is built on first use
+llm_bots = LazyLLMBots()
 # Optional: Web RAG vector store and state per user
-user_rag_state = {} # {user_id: {"enabled": bool, "url": str, "vector_store": FAISS_object}}
+user_rag_state = TTLCache(MAX_ACTIVE_USERS, USER_STATE_TTL, sliding=True,
+                          on_evict=_log_user_eviction("user_rag_state")) # {user_id: {"enabled": bool, "url": str, "vector_store": FAISS_object}}
+# Answers to RAG questions, keyed by the meaning of the question per tenant, user, LLM and source URL, so a user's
+# rephrasings of an earlier question skip both retrieval and the LLM call. Answers depend on the user's chat
+# history, so they are never shared between users.
+answer_cache = SemanticCache(threshold=0.95, maxsize=64, ttl=3600, max_namespaces=MAX_ACTIVE_USERS)
 
 # --- Helper Functions ---
+# Telegram shows "typing..." for about 5 seconds per chat action, so one is sent at most this often per chat
+TYPING_ACTION_INTERVAL = 4.0
+_recent_typing_actions = TTLCache(MAX_ACTIVE_USERS, TYPING_ACTION_INTERVAL) # {chat_id: True}
+# Fire-and-forget Telegram calls still running; referenced here so they aren't garbage-collected mid-flight
+_background_tasks = set()
+
+def run_in_background(coro) -> None:
+    """Starts a Telegram call (typing action, status message) without waiting for it; failures are logged."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_finish_background_task)
+
+def _finish_background_task(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning("Background Telegram call failed: %s", task.exception())
+
+# One lock per user with an update in progress; an entry disappears once no handler holds or waits for its lock
+_user_locks = weakref.WeakValueDictionary() # {user_id: asyncio.Lock}
+
+def one_update_per_user(handler):
+    """
+    Wraps a handler so each user's updates are handled one at a time, in arrival order, while different users'
+    updates still run concurrently (see concurrent_updates in main). Without it, two quick messages from one user
+    would both append to their ChatSession and change their state at the same time.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if user is None:
+            return await handler(update, context)
+        lock = _user_locks.get(user.id)
+        if lock is None:
+            lock = _user_locks[user.id] = asyncio.Lock()
+        async with lock:
+            return await handler(update, context)
+    return wrapper
+
 async def send_typing_action(update: Update):
-    """Sends a typing action to the user."""
+    """Sends a typing action to the user, unless one was sent to this chat in the last few seconds."""
+    chat_id = update.effective_chat.id
+    if _recent_typing_actions.get(chat_id):
+        return
+    _recent_typing_actions.set(chat_id, True)
     await update.effective_chat.send_chat_action(action="typing")
 
 async def get_user_session(user_id: int) -> ChatSession:
     """Gets or creates a chat session for a user."""
-    if user_id not in user_sessions:
-        user_sessions[user_id] = ChatSession()
-    return user_sessions[user_id]
+    session = user_sessions.get(user_id)
+    if session is None: # New user, or their session expired or was evicted
+        session = ChatSession()
+        user_sessions.set(user_id, session)
+    return session
 
 # --- Telegram Command Handlers ---
 
@@ -76,8 +148,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     # Reset history for new session if started via /start
     session = await get_user_session(user.id)
     session.clear_history()
-    if user.id in user_rag_state: # Clear RAG state on start
-        del user_rag_state[user.id]
+    user_rag_state.pop(user.id) # Clear RAG state on start
 
 async def choose_llm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles callback query for LLM selection."""
@@ -87,7 +158,7 @@ async def choose_llm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = query.from_user.id
     choice = query.data.split('_')[-1] # Extracts 'gemini' or 'ollama'
 
-    user_llm_choice[user_id] = choice
+    user_llm_choice.set(user_id, choice)
     logger.info(f"User {user_id} chose LLM: {choice}")
 
     await query.edit_message_text(text=f"You've selected **{choice.upper()}**. You can now start chatting!\n\n"
@@ -101,8 +172,7 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = update.effective_user.id
     session = await get_user_session(user_id)
     session.clear_history()
-    if user_id in user_rag_state:
-        del user_rag_state[user_id] # Also clear RAG state on reset
+    user_rag_state.pop(user_id) # Also clear RAG state on reset
     await update.message.reply_text("Your chat history and RAG context (if any) have been cleared.")
     logger.info(f"User {user_id} cleared chat history and RAG state.")
 
@@ -117,8 +187,7 @@ async def enable_rag_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def disable_rag_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Disables Web RAG for the user."""
     user_id = update.effective_user.id
-    if user_id in user_rag_state:
-        del user_rag_state[user_id]
+    if user_rag_state.pop(user_id) is not None:
         await update.message.reply_text("Web RAG has been disabled for this session.")
         logger.info(f"User {user_id} disabled Web RAG.")
     else:
@@ -128,34 +197,34 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Handles incoming text messages from users."""
     user_id = update.effective_user.id
     user_text = update.message.text
-    logger.info(f"User {user_id} message: {user_text}")
+    logger.info("User %s message: %s", user_id, user_text)
 
     # Check if we are awaiting a URL for RAG setup
     if context.user_data.get('awaiting_url'):
         url = user_text.strip()
         context.user_data['awaiting_url'] = False # Reset flag
 
-        await send_typing_action(update)
-        await update.message.reply_text(f"Processing content from {url} for RAG. This might take a moment...")
+        run_in_background(send_typing_action(update))
+        run_in_background(update.message.reply_text(f"Processing content from {url} for RAG. This might take a moment..."))
 
-        vector_store, error = create_vector_store_from_web(url)
+        # Users who pick the same URL share one vector store instead of each embedding the site again
+        vector_store, error = await get_vector_store_for_url(url, BOT_ACTIVE_TENANT_ID)
         if vector_store:
-            user_rag_state[user_id] = {"enabled": True, "url": url, "vector_store": vector_store}
+            user_rag_state.set(user_id, {"enabled": True, "url": url, "vector_store": vector_store})
             await update.message.reply_text(f"Knowledge base from {url} loaded successfully! You can now ask questions related to it.")
             logger.info(f"User {user_id} successfully loaded RAG from {url}.")
         else:
             await update.message.reply_text(f"Failed to load knowledge base from {url}: {error}. Web RAG remains disabled.")
-            if user_id in user_rag_state:
-                del user_rag_state[user_id]
+            user_rag_state.pop(user_id)
             logger.warning(f"User {user_id} failed to load RAG from {url}: {error}")
         return # Stop processing, as this message was a URL input
 
     # Ensure LLM is chosen before processing messages
-    if user_id not in user_llm_choice:
+    llm_type = user_llm_choice.get(user_id)
+    if llm_type is None:
         await update.message.reply_text("Please choose an LLM first by typing /start.")
         return
 
-    llm_type = user_llm_choice[user_id]
     current_bot = llm_bots[llm_type]
     session = await get_user_session(user_id)
 
@@ -164,30 +233,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # Retrieve context if RAG is enabled for this user
     context_text = None
-    if user_id in user_rag_state and user_rag_state[user_id]["enabled"]:
-        vector_store = user_rag_state[user_id]["vector_store"]
+    query_embedding = None
+    rag_state = user_rag_state.get(user_id)
+    if rag_state and rag_state["enabled"] and needs_context(user_text):
+        vector_store = rag_state["vector_store"]
         if vector_store:
-            await send_typing_action(update) # Show typing while retrieving context
-            retrieved_context = retrieve_context_from_vector_store(vector_store, user_text)
+            run_in_background(send_typing_action(update)) # Show typing while retrieving context
+            cache_namespace = answer_namespace(BOT_ACTIVE_TENANT_ID, user_id, llm_type, rag_state['url'])
+            query_embedding = await run_in_rag_executor(embed_query, vector_store, user_text)
+            if query_embedding is not None:
+                cached_response = answer_cache.get(cache_namespace, query_embedding)
+                if cached_response:
+                    logger.info("Semantic cache hit for user %s on %s.", user_id, rag_state['url'])
+                    session.add_message("model", cached_response)
+                    await update.message.reply_text(cached_response)
+                    return
+
+            retrieved_context = await run_in_rag_executor(retrieve_context_from_vector_store, vector_store, user_text,
+                                                          query_embedding=query_embedding)
             if retrieved_context:
                 context_text = retrieved_context
-                logger.info(f"Context retrieved for user {user_id}: {retrieved_context[:100]}...")
+                logger.info("Context retrieved for user %s: %.100s...", user_id, retrieved_context)
             else:
-                await update.message.reply_text("[No highly relevant context found from the website for this query.]")
-                logger.info(f"No relevant context found for user {user_id}.")
-
-    # Send typing indicator while LLM processes
-    await send_typing_action(update)
-
-    # Get response from the selected bot, passing context if available
-    response_text = current_bot.get_response(session.get_history(), context=context_text)
+                run_in_background(update.message.reply_text("[No highly relevant context found from the website for this query.]"))
+                logger.info("No relevant context found for user %s.", user_id)
+
+    # Send typing indicator while LLM processes (skipped if one was just sent during retrieval)
+    run_in_background(send_typing_action(update))
+
+    # Stream the response from the selected bot, passing context if available: the first piece is sent as soon as
+    # it arrives and the message is then edited as the rest comes in (throttled, as Telegram rate-limits edits)
+    response_text = ""
+    sent_text = ""
+    reply_message = None
+    last_edit_time = 0.0
+    try:
+        async for piece in current_bot.stream_response(session.get_history(current_bot.history_format), context=context_text):
+            response_text += piece
+            if reply_message is None:
+                reply_message = await update.message.reply_text(response_text)
+            elif time.monotonic() - last_edit_time < STREAM_EDIT_INTERVAL:
+                continue
+            else:
+                await reply_message.edit_text(response_text)
+            sent_text, last_edit_time = response_text, time.monotonic()
+    except Exception as e:
+        # Don't add error messages to history
+        logger.error(f"Error streaming {llm_type} response for user {user_id}: {e}")
+        await update.message.reply_text(f"Error communicating with {llm_type.upper()}: {e}")
+        return
 
-    # Add bot's response to history if it's not an error message
-    if not response_text.startswith("Error"):
-        session.add_message("model", response_text)
+    if not response_text:
+        await update.message.reply_text(f"No text response received from {llm_type.upper()}.")
+        return
+    if sent_text != response_text:
+        await reply_message.edit_text(response_text)
 
-    await update.message.reply_text(response_text)
-    logger.info(f"Bot responded to {user_id} ({llm_type}): {response_text[:100]}...")
+    session.add_message("model", response_text)
+    if query_embedding is not None:
+        answer_cache.set(cache_namespace, query_embedding, response_text)
+    logger.info("Bot responded to %s (%s): %.100s...", user_id, llm_type, response_text)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -197,22 +302,33 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.effective_message.reply_text("An error occurred. Please try again or type /reset.")
 
 
+async def close_http_clients(application: Application) -> None:
+    """Closes the page-fetching session on shutdown, from the loop it was used on, so its connections shut down cleanly."""
+    await close_http_session()
+
+
 def main() -> None:
     """Starts the bot."""
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN environment variable not set. Please add it to your .env file.")
         return
 
+    # Build the LLM bots in the background while the application starts, so the first users don't wait for them
+    llm_bots.prewarm_in_background()
+
     # Create the Application and pass your bot's token.
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # concurrent_updates lets different users' updates be handled at the same time instead of queueing behind one
+    # LLM call; each handler is wrapped in one_update_per_user, so one user's own updates still run one at a time.
+    application = (Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(True)
+                   .post_shutdown(close_http_clients).build())
 
     # Register handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("reset", reset_command))
-    application.add_handler(CommandHandler("enable_rag", enable_rag_command))
-    application.add_handler(CommandHandler("disable_rag", disable_rag_command))
-    application.add_handler(CallbackQueryHandler(choose_llm_callback, pattern="^set_llm_"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("start", one_update_per_user(start_command)))
+    application.add_handler(CommandHandler("reset", one_update_per_user(reset_command)))
+    application.add_handler(CommandHandler("enable_rag", one_update_per_user(enable_rag_command)))
+    application.add_handler(CommandHandler("disable_rag", one_update_per_user(disable_rag_command)))
+    application.add_handler(CallbackQueryHandler(one_update_per_user(choose_llm_callback), pattern="^set_llm_"))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, one_update_per_user(handle_message)))
 
     # Error handler
     application.add_error_handler(error_handler)
@@ -1,14 +1,189 @@
-import requests
+import aiohttp
+import asyncio
+import bisect
+import faiss
+import functools
+import hashlib
+import logging
+import numpy as np
+import ollama
+import os
+import re
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
-from langchain_text_splitters import CharacterTextSplitter
+try:
+    from selectolax.parser import HTMLParser # C-based parser, much faster than BeautifulSoup's html.parser
+except ImportError:
+    HTMLParser = None
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 import time
 
-def fetch_web_content(url: str) -> str:
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Shared, bounded pool for the blocking RAG work (HTML parsing, embedding calls, FAISS build and search).
+# It keeps that work off the event loop and caps how many embedding requests hit Ollama at once.
+_RAG_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag")
+
+async def run_in_rag_executor(func, *args, **kwargs):
+    """Runs a blocking RAG call on the shared RAG thread pool and returns its result."""
+    return await asyncio.get_running_loop().run_in_executor(_RAG_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+class OllamaBatchEmbeddings(Embeddings):
+    """
+    LangChain embeddings backed by Ollama's /api/embed endpoint, which embeds a whole list of texts per request.
+    langchain_community's OllamaEmbeddings sends one request per chunk, so a page with dozens of chunks
+    paid dozens of sequential round-trips.
+    """
+    def __init__(self, model: str = "phi3:mini", batch_size: int = 64):
+        self.model = model
+        self.batch_size = batch_size
+        self._client = ollama.Client()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self._client.embed(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(response['embeddings'])
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        # Same endpoint as the documents, so query and chunk vectors are directly comparable
+        return self._client.embed(model=self.model, input=text)['embeddings'][0]
+
+@functools.cache
+def get_embeddings(model: str = "phi3:mini") -> OllamaBatchEmbeddings:
+    """
+    Returns the process-wide embeddings client for a model, created on first use.
+    Every vector store built with the model (and its query embeddings) shares the one client and its
+    HTTP connection pool instead of setting up a new one per store.
+    """
+    return OllamaBatchEmbeddings(model=model)
+
+# Chunk embeddings saved on disk, one .npy file per chunk named by the SHA-256 of its text, so a URL that is
+# loaded again (or another page sharing chunks with it) doesn't send those chunks to Ollama a second time.
+# Kept outside the source tree by default; EMBEDDING_CACHE_DIR moves it, e.g. onto a persistent volume.
+_EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "chat_rag_app", "embeddings")
+# Bounds on each model's cache folder, enforced when the folder is first used by a process: vectors not used for
+# EMBEDDING_CACHE_MAX_AGE_DAYS are deleted, then the least recently used ones beyond EMBEDDING_CACHE_MAX_FILES
+_EMBEDDING_CACHE_MAX_AGE = float(os.getenv("EMBEDDING_CACHE_MAX_AGE_DAYS", "30")) * 86400
+_EMBEDDING_CACHE_MAX_FILES = int(os.getenv("EMBEDDING_CACHE_MAX_FILES", "100000"))
+
+@functools.cache
+def _prepare_embedding_cache_dir(cache_dir: str) -> str:
+    """
+    Creates a model's embedding cache folder and prunes it to the size and age bounds, once per folder and
+    process, and returns the folder.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass # Removed meanwhile
+    entries.sort() # Least recently used first; a cache hit refreshes the file's mtime
+    expired_before = time.time() - _EMBEDDING_CACHE_MAX_AGE
+    excess = len(entries) - _EMBEDDING_CACHE_MAX_FILES
+    removed = 0
+    for i, (mtime, path) in enumerate(entries):
+        if mtime >= expired_before and i >= excess:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info("Pruned %d of %d cached embeddings in %s", removed, len(entries), cache_dir)
+    return cache_dir
+
+def _embed_with_cache(embeddings: OllamaBatchEmbeddings, texts: list[str]) -> list[list[float]]:
+    """
+    Embeds texts, loading vectors cached on disk and batch-embedding only the texts not seen before.
+    Args:
+        embeddings (OllamaBatchEmbeddings): The embeddings model to use for cache misses.
+        texts (list[str]): The chunk texts to embed.
+    Returns:
+        list[list[float]]: One vector per text, in the same order as texts.
+    """
+    # Vectors from different models aren't interchangeable, so each model gets its own folder
+    cache_dir = _prepare_embedding_cache_dir(
+        os.path.join(_EMBEDDING_CACHE_DIR, embeddings.model.replace(':', '_').replace('/', '_')))
+
+    paths = [os.path.join(cache_dir, f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}.npy") for text in texts]
+    vectors = [None] * len(texts)
+    missing = []
+    for i, path in enumerate(paths):
+        try:
+            vectors[i] = np.load(path).tolist()
+            os.utime(path) # Marks the vector as recently used, so pruning drops unused ones first
+        except (OSError, ValueError): # Not cached yet, or a damaged file that gets rewritten below
+            missing.append(i)
+
+    if missing:
+        logger.debug("Embedding %d of %d chunks (%d cached)", len(missing), len(texts), len(texts) - len(missing))
+        for i, vector in zip(missing, embeddings.embed_documents([texts[i] for i in missing])):
+            vectors[i] = vector
+            tmp_path = f"{paths[i]}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(vector, dtype=np.float32))
+            os.replace(tmp_path, paths[i]) # Atomic, so a concurrent reader never sees a half-written file
+    return vectors
+
+# One aiohttp session per event loop, so repeated fetches reuse pooled connections instead of new TLS handshakes
+_HTTP_SESSIONS = weakref.WeakKeyDictionary() # {event loop: aiohttp.ClientSession}
+
+def _get_http_session() -> aiohttp.ClientSession:
+    """Returns the aiohttp session for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    session = _HTTP_SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = _HTTP_SESSIONS[loop] = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+    return session
+
+async def close_http_session() -> None:
+    """Closes the running event loop's page-fetching session, if any. Call it on shutdown, from that loop."""
+    session = _HTTP_SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+# Pages are read in chunks and cut off at this size, so one huge (or hostile) URL can't exhaust memory
+_MAX_PAGE_BYTES = 4 * 1024 * 1024
+_READ_CHUNK_BYTES = 64 * 1024
+
+def _extract_text(html: bytes) -> str:
+    """
+    Extracts the visible text from an HTML page, dropping scripts and styles.
+    Takes the raw bytes, so the page is never held twice (as bytes and as a decoded string); both parsers
+    detect the encoding themselves.
+    """
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        for script_or_style in tree.css('script, style'):
+            script_or_style.decompose()
+        return tree.root.text(separator=' ', strip=True) if tree.root else ""
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    for script_or_style in soup(['script', 'style']):
+        script_or_style.extract()
+
+    return soup.get_text(separator=' ', strip=True)
+
+async def fetch_web_content(url: str) -> str:
     """
     Fetches the main text content from a given URL.
+    The download is awaited, so the event loop keeps serving other users meanwhile, and the
+    CPU-bound HTML parsing runs on the RAG thread pool.
     Args:
         url (str): The URL of the webpage to fetch.
     Returns:
@@ -17,71 +192,246 @@ def fetch_web_content(url: str) -> str:
     print(f"[DEBUG] Starting fetch for {url}")
     fetch_start_time = time.time()
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        async with _get_http_session().get(url) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(_READ_CHUNK_BYTES):
+                chunks.append(chunk[:_MAX_PAGE_BYTES - size])
+                size += len(chunks[-1])
+                if size >= _MAX_PAGE_BYTES:
+                    print(f"[DEBUG] {url} is larger than {_MAX_PAGE_BYTES} bytes; only the first part is used")
+                    break
+        html = b"".join(chunks)
+        del chunks
 
-        for script_or_style in soup(['script', 'style']):
-            script_or_style.extract()
-
-        text = soup.get_text(separator=' ', strip=True)
+        text = await run_in_rag_executor(_extract_text, html)
+        del html # The page source can be large; don't keep it alive alongside the text
         fetch_end_time = time.time()
         print(f"[DEBUG] Finished fetching content ({len(text)} chars) in {fetch_end_time - fetch_start_time:.2f}s")
         return text
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Error fetching URL {url}: {e}")
         return ""
     except Exception as e:
         print(f"An unexpected error occurred while processing URL {url}: {e}")
         return ""
 
-def create_vector_store_from_web(url: str):
+# Stores with at least this many chunks get an HNSW graph index, whose search time grows logarithmically.
+# Smaller stores (a typical single page) are searched exhaustively, which is exact and still faster at that size.
+_HNSW_MIN_CHUNKS = 2000
+_HNSW_M = 32 # Graph neighbours per vector
+_HNSW_EF_CONSTRUCTION = 200
+# Candidates explored per HNSW search: raise for better recall, lower for faster queries
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+
+# FAISS picks its AVX2/AVX-512 build at import when the CPU supports it; the generic build is several times
+# slower at the distance computations every search does, so say so when that's what was loaded
+if not any(simd in faiss.get_compile_options() for simd in ("AVX2", "AVX512")):
+    logger.warning(f"FAISS was loaded without AVX2/AVX-512 support ({faiss.get_compile_options()}); "
+                   f"vector search will be slower. Install faiss-cpu>=1.8 on an AVX2-capable CPU.")
+
+def _build_faiss_index(vectors: np.ndarray):
     """
-    Fetches web content, splits it into chunks, and creates a FAISS vector store.
+    Builds the FAISS index for a store's chunk vectors.
+    Vectors are normalized to unit length here (in place) and compared by inner product, so each cosine
+    similarity is a single dot product. Vectors are stored as 8-bit scalar-quantized codes, a quarter of the float32 size, so the stores kept
+    for many tenants and URLs take less memory and each search reads fewer bytes.
     Args:
-        url (str): The URL to process.
+        vectors (np.ndarray): (n_chunks, dim) C-contiguous float32 chunk embeddings.
     Returns:
-        FAISS: A FAISS vector store, or None if processing fails.
-        str: An error message if something goes wrong, None otherwise.
+        faiss.Index: An HNSW index for large stores, otherwise a flat index.
     """
-    print(f"[Fetching content from: {url}]")
-    raw_text = fetch_web_content(url)
+    faiss.normalize_L2(vectors)
+    dim = vectors.shape[1]
+    if len(vectors) >= _HNSW_MIN_CHUNKS:
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, _HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors) # Learns each dimension's value range for the 8-bit codes
+    index.add(vectors)
+    return index
 
-    if not raw_text:
-        return None, "Could not fetch content from the URL or URL is empty."
+# End of a paragraph or sentence: the preferred places to end a chunk
+_SENTENCE_END_RE = re.compile(r"\n\s*\n|[.!?](?=\s)")
 
-    documents = [Document(page_content=raw_text, metadata={"source": url})]
+def _split_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[str]:
+    """
+    Splits text into chunks of at most chunk_size characters, each overlapping the previous one by up to
+    chunk_overlap characters. A chunk ends at the last paragraph or sentence end in its second half, or
+    failing that at a space, so words and (where possible) sentences aren't cut.
+    Split points come from one regex pass plus binary searches instead of walking the text in Python.
+    Args:
+        text (str): The text to split.
+        chunk_size (int): Maximum characters per chunk.
+        chunk_overlap (int): Maximum characters repeated from the end of the previous chunk.
+    Returns:
+        list[str]: The non-empty chunks, in text order.
+    """
+    sentence_ends = [match.end() for match in _SENTENCE_END_RE.finditer(text)]
+    chunks = []
+    start, length = 0, len(text)
+    while start < length:
+        end = start + chunk_size
+        if end < length:
+            i = bisect.bisect_right(sentence_ends, end) - 1
+            if i >= 0 and sentence_ends[i] > start + chunk_size // 2:
+                end = sentence_ends[i]
+            else:
+                space = text.rfind(' ', start + chunk_size // 2, end)
+                if space != -1:
+                    end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        # The next chunk starts at a space inside the overlap window, so it doesn't begin mid-word
+        space = text.find(' ', end - chunk_overlap, end)
+        start = space + 1 if space != -1 else end
+    return chunks
 
+def _build_vector_store(raw_text: str, url: str):
+    """
+    Splits fetched text into chunks and embeds them into a FAISS vector store.
+    Blocking (embedding calls and index build), so it runs on the RAG thread pool.
+    Returns:
+        FAISS: A FAISS vector store, or None if processing fails.
+        str: An error message if something goes wrong, None otherwise.
+    """
     print("[Splitting document into chunks...]")
     split_start_time = time.time()
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    docs = text_splitter.split_documents(documents)
+    texts = _split_text(raw_text, chunk_size=1000, chunk_overlap=200)
     split_end_time = time.time()
-    print(f"[DEBUG] Finished splitting into {len(docs)} chunks in {split_end_time - split_start_time:.2f}s")
+    print(f"[DEBUG] Finished splitting into {len(texts)} chunks in {split_end_time - split_start_time:.2f}s")
 
-    if not docs:
+    if not texts:
         return None, "Document splitting resulted in no chunks. Content might be too small or text splitter issue."
 
     print("[Creating vector store with Ollama Embeddings (phi3:mini)]")
     embed_start_time = time.time()
-    embeddings = OllamaEmbeddings(model="phi3:mini")
-    vectorstore = FAISS.from_documents(docs, embeddings)
+    try:
+        embeddings = get_embeddings("phi3:mini")
+        vectors = _embed_with_cache(embeddings, texts) # Cached chunks are read from disk, the rest batched
+        index = _build_faiss_index(np.asarray(vectors, dtype=np.float32))
+        docstore = InMemoryDocstore({str(i): Document(page_content=text, metadata={"source": url})
+                                     for i, text in enumerate(texts)})
+        # Query vectors are normalized by embed_query to match the normalized chunk vectors; the store's own
+        # normalize_L2 option is left off, as LangChain warns on every build that combines it with inner product
+        vectorstore = FAISS(embedding_function=embeddings, index=index, docstore=docstore,
+                            index_to_docstore_id={i: str(i) for i in range(len(texts))},
+                            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT)
+    except Exception as e:
+        return None, f"Error creating vector store: {e}"
     embed_end_time = time.time()
     print(f"[DEBUG] Finished creating vector store in {embed_end_time - embed_start_time:.2f}s")
 
+    print("[Vector store created successfully.]")
+    return vectorstore, None
+
+async def create_vector_store_from_web(url: str):
+    """
+    Fetches web content, splits it into chunks, and creates a FAISS vector store.
+    Args:
+        url (str): The URL to process.
+    Returns:
+        FAISS: A FAISS vector store, or None if processing fails.
+        str: An error message if something goes wrong, None otherwise.
+    """
+    print(f"[Fetching content from: {url}]")
+    raw_text = await fetch_web_content(url)
+
+    if not raw_text:
+        return None, "Could not fetch content from the URL or URL is empty."
+
+    return await run_in_rag_executor(_build_vector_store, raw_text, url)
+
+# Vector stores built for Web RAG, shared by every user (of the same tenant) so a URL is crawled and embedded
+# once rather than once per user. Keyed by (tenant_id, url); stores expire so the site is eventually re-read.
+_VECTOR_STORE_CACHE = TTLCache(maxsize=16, ttl=6 * 3600)
+# Builds in progress, so users asking for the same URL at the same time wait for one build instead of each starting one
+_VECTOR_STORE_BUILDS = {} # {(tenant_id, url): asyncio.Task}
+
+async def _build_and_cache_vector_store(key: tuple, url: str):
+    """Builds the vector store for url and caches it under key; always removes its in-progress entry."""
     try:
-        print("[Vector store created successfully.]")
+        vectorstore, error = await create_vector_store_from_web(url)
+        if vectorstore is not None:
+            _VECTOR_STORE_CACHE.set(key, vectorstore)
+        return vectorstore, error
+    finally:
+        _VECTOR_STORE_BUILDS.pop(key, None)
+
+async def get_vector_store_for_url(url: str, tenant_id: str = None):
+    """
+    Returns the vector store for a URL, building it only if no user has loaded that URL recently.
+    Concurrent requests for a URL that is still being built share that one build.
+    Args:
+        url (str): The URL to process.
+        tenant_id (str, optional): Tenant the store belongs to, so tenants never share a store.
+    Returns:
+        FAISS: A FAISS vector store, or None if processing fails.
+        str: An error message if something goes wrong, None otherwise.
+    """
+    key = (tenant_id, url)
+    vectorstore = _VECTOR_STORE_CACHE.get(key)
+    if vectorstore is not None:
         return vectorstore, None
+
+    build = _VECTOR_STORE_BUILDS.get(key)
+    if build is None:
+        build = _VECTOR_STORE_BUILDS[key] = asyncio.create_task(_build_and_cache_vector_store(key, url))
+    # Shielded so one user giving up (e.g. a cancelled handler) doesn't cancel the build for everyone else
+    return await asyncio.shield(build)
+
+# Small-talk messages that never need website context
+_SMALL_TALK = frozenset({
+    "hi", "hii", "hello", "hey", "hola", "yo", "good morning", "good afternoon", "good evening",
+    "ok", "okay", "k", "cool", "great", "nice", "sure", "yes", "no", "yep", "nope",
+    "thanks", "thank you", "thanks a lot", "thx", "ty", "bye", "goodbye", "see you",
+})
+
+def needs_context(query: str) -> bool:
+    """
+    Tells whether a query is worth a vector store lookup.
+    Greetings, acknowledgements and messages without any letters or digits are answered without context.
+    Args:
+        query (str): The user's query.
+    Returns:
+        bool: False if retrieval can be skipped for this query.
+    """
+    normalized = " ".join("".join(ch if ch.isalnum() else " " for ch in query.lower()).split())
+    return bool(normalized) and normalized not in _SMALL_TALK
+
+def embed_query(vectorstore, query: str) -> list[float] | None:
+    """
+    Embeds a query with the same embeddings model the vector store was built with, normalized to unit length
+    like the store's chunk vectors so inner product search ranks by cosine similarity.
+    Args:
+        vectorstore (FAISS): The FAISS vector store.
+        query (str): The user's query.
+    Returns:
+        list[float] | None: The query embedding, or None if embedding fails.
+    """
+    try:
+        vector = np.asarray([vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector[0].tolist()
     except Exception as e:
-        return None, f"Error creating vector store: {e}"
+        print(f"Error embedding query: {e}")
+        return None
 
-def retrieve_context_from_vector_store(vectorstore, query: str, k=3) -> str:
+def retrieve_context_from_vector_store(vectorstore, query: str, k=3, query_embedding: list[float] = None) -> str:
     """
     Retrieves relevant document chunks from the vector store based on the query.
     Args:
         vectorstore (FAISS): The FAISS vector store.
         query (str): The user's query.
         k (int): The number of top relevant chunks to retrieve.
+        query_embedding (list[float], optional): The query's embed_query embedding, if already computed, to avoid
+            embedding it again.
     Returns:
         str: Concatenated text of the retrieved chunks.
     """
@@ -91,7 +441,11 @@ def retrieve_context_from_vector_store(vectorstore, query: str, k=3) -> str:
     print(f"[DEBUG] Retrieving context for query: {query[:50]}...")
     retrieve_start_time = time.time()
     try:
-        retrieved_docs = vectorstore.similarity_search(query, k=k)
+        if query_embedding is None:
+            query_embedding = embed_query(vectorstore, query)
+            if query_embedding is None:
+                return ""
+        retrieved_docs = vectorstore.similarity_search_by_vector(query_embedding, k=k)
         context = "\n\n".join([doc.page_content for doc in retrieved_docs])
         retrieve_end_time = time.time()
         print(f"[DEBUG] Finished retrieving context in {retrieve_end_time - retrieve_start_time:.2f}s")
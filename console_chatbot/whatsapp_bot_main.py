@@ -6,22 +6,28 @@ import sys # Import sys module at the very top
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(project_root)
 
+import asyncio
+import atexit
 import logging
-import json
+import orjson
+import threading
 from flask import Flask, request, jsonify, redirect, url_for
 from dotenv import load_dotenv
-import requests # For making requests to Meta's WhatsApp API
+import httpx # Async client for Meta's WhatsApp API
 
 # Import your existing bot logic and session manager
 from chat_session import ChatSession # Still needed for individual session objects within BotHandler
-from gemini_bot import GeminiBot
-from ollama_bot import OllamaBot
-from web_rag_utils import create_vector_store_from_web, retrieve_context_from_vector_store
+from llm_bots import LazyLLMBots
+from web_rag_utils import close_http_session, create_vector_store_from_web, retrieve_context_from_vector_store
 
 # NEW: Import BotHandler and Zoho Auth Manager
-from bot_handler import BotHandler # BotHandler now encapsulates CRM/RAG logic
+from bot_handler import BotHandler, ConversationState # BotHandler now encapsulates CRM/RAG logic
 from console_chatbot.zoho_auth_manager import ZohoAuthManager # Import the new ZohoAuthManager class
 from utils.tenant_loader import load_all_tenants_config # To load tenants.json
+from utils.rate_limiter import AsyncTokenBucket
+from utils.log_setup import configure_logging
+from integrations import http_client as crm_http_client
+from utils.ttl_cache import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -35,19 +41,60 @@ WHATSAPP_WEBHOOK_VERIFY_TOKEN = os.getenv("WHATSAPP_WEBHOOK_VERIFY_TOKEN")
 BOT_ACTIVE_TENANT_ID = os.getenv("BOT_ACTIVE_TENANT_ID", None) # Default to None, pick first if not set
 
 # Set up logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+configure_logging(level=logging.INFO) # Log records are written to stderr by a background thread
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 # --- Global Storage ---
-user_bot_handlers = {} # {user_id: BotHandler object}
-llm_bots = { # LLM instances are global as they don't change per user
-    "gemini": GeminiBot(),
-    "ollama": OllamaBot()
-}
+# Handlers are dropped after USER_STATE_TTL seconds without activity, or earlier once MAX_ACTIVE_USERS more recent
+# users exist, so a long-running server doesn't keep every user it has ever seen
+MAX_ACTIVE_USERS = 10_000
+USER_STATE_TTL = 3600
+
+def _log_handler_eviction(user_id, bot_handler):
+    logger.warning(f"user_bot_handlers is full ({MAX_ACTIVE_USERS} users); dropped least recently active user {user_id}.")
+
+user_bot_handlers = TTLCache(MAX_ACTIVE_USERS, USER_STATE_TTL, sliding=True,
+                             on_evict=_log_handler_eviction) # {user_id: BotHandler object}
+# Handlers with webhook messages queued or being processed, kept apart from user_bot_handlers so they can't be
+# evicted or expire mid-conversation: a later webhook then reuses the handler, and waits on its message_lock,
+# instead of creating a second handler that would answer the same user concurrently
+_busy_handlers = {} # {user_id: [BotHandler object, number of webhooks using it]}
+_busy_handlers_lock = threading.Lock()
+
+def _acquire_handler(user_id: str) -> BotHandler:
+    """
+    Returns the user's BotHandler, creating it if needed, and marks it busy until _release_handler is called.
+    """
+    with _busy_handlers_lock:
+        busy = _busy_handlers.get(user_id)
+        if busy is None:
+            bot_handler_instance = user_bot_handlers.get(user_id)
+            if bot_handler_instance is None: # New user, or their handler expired or was evicted
+                # Pass the active_tenant_config to the BotHandler
+                bot_handler_instance = BotHandler(user_id, llm_bots, active_tenant_config)
+                logger.info(f"New BotHandler created for user: {user_id} with tenant {active_tenant_config.get('tenant_id', 'N/A')}")
+            busy = _busy_handlers[user_id] = [bot_handler_instance, 0]
+        busy[1] += 1
+    user_bot_handlers.set(user_id, busy[0]) # Restart its time-to-live; re-inserts it if it was evicted
+    return busy[0]
+
+def _release_handler(user_id: str) -> None:
+    """Undoes one _acquire_handler call, leaving the handler to user_bot_handlers once no webhook uses it."""
+    with _busy_handlers_lock:
+        busy = _busy_handlers[user_id]
+        busy[1] -= 1
+        if not busy[1]:
+            del _busy_handlers[user_id]
+llm_bots = LazyLLMBots() # LLM instances are global as they don't change per user; each is built on first use
+llm_bots.prewarm_in_background() # ...or ahead of it, off the startup path
+
+# --- Async Bot Loop ---
+# BotHandler is async; a single long-lived event loop runs it for every webhook request so the
+# async LLM clients can keep their connections open between requests.
+bot_loop = asyncio.new_event_loop()
+threading.Thread(target=bot_loop.run_forever, name="bot-event-loop", daemon=True).start()
 
 # --- Tenant Configuration ---
 all_tenants_config = load_all_tenants_config()
@@ -80,14 +127,75 @@ ZOHO_REDIRECT_URI_PATH = "/zoho-oauth-callback"
 
 # --- WhatsApp API Constants ---
 WHATSAPP_API_URL = f"https://graph.facebook.com/v19.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+# Replies are sent from the bot loop without blocking a thread per request. The client keeps its connections to
+# Meta open between sends (multiplexed over HTTP/2), so only the first message pays for the TCP and TLS handshakes.
+whatsapp_client = httpx.AsyncClient(
+    http2=True,
+    headers={
+        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+    },
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=128, max_keepalive_connections=32),
+)
+# Sends are paced below Meta's per-number throughput limit, so bursts queue up here instead of being rejected.
+# This process serves a single tenant (BOT_ACTIVE_TENANT_ID), so one bucket is that tenant's bucket.
+WHATSAPP_SENDS_PER_SECOND = 80
+WHATSAPP_SEND_ATTEMPTS = 4
+whatsapp_send_limiter = AsyncTokenBucket(rate=WHATSAPP_SENDS_PER_SECOND)
+
+def _close_http_clients() -> None:
+    """Closes the bot loop's HTTP clients (Meta, CRM and web pages) at exit, so their pooled connections shut down cleanly."""
+    async def close_all():
+        await asyncio.gather(whatsapp_client.aclose(), crm_http_client.close(), close_http_session())
+    try:
+        asyncio.run_coroutine_threadsafe(close_all(), bot_loop).result(timeout=5)
+    except Exception as e:
+        logger.warning(f"Could not close HTTP clients cleanly: {e}")
+
+atexit.register(_close_http_clients)
 
 # --- Helper Functions ---
-def send_whatsapp_message(to_number: str, message_body: str) -> None:
+async def post_whatsapp_payload(payload: dict) -> httpx.Response:
+    """
+    Posts a message payload to the WhatsApp Cloud API through the send rate limiter.
+    The payload is serialized with orjson; the client already sends the JSON Content-Type header.
+    Only sends Meta is known not to have delivered are retried: rate-limited (429) ones after the Retry-After
+    delay Meta asks for, and ones whose connection failed before the request was sent after an exponential
+    back-off. 5xx errors and timeouts are not retried, as the message may already have reached the user.
+    Args:
+        payload (dict): The message payload.
+    Returns:
+        httpx.Response: The successful API response.
+    Raises:
+        httpx.HTTPError: If the send fails, or still fails after the last retry.
+    """
+    for attempt in range(WHATSAPP_SEND_ATTEMPTS):
+        last_attempt = attempt == WHATSAPP_SEND_ATTEMPTS - 1
+        delay = 2 ** attempt
+        await whatsapp_send_limiter.acquire()
+        try:
+            response = await whatsapp_client.post(WHATSAPP_API_URL, content=orjson.dumps(payload))
+        except httpx.ConnectError as e:
+            if last_attempt:
+                raise
+            logger.warning(f"Could not connect to the WhatsApp API ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        if last_attempt or response.status_code != 429:
+            response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+            return response
+
+        try:
+            delay = float(response.headers.get("Retry-After", delay))
+        except ValueError:
+            pass # Retry-After given as an HTTP date; keep the back-off delay
+        logger.warning(f"WhatsApp API returned 429; retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+async def send_whatsapp_message(to_number: str, message_body: str) -> None:
     """Sends a text message back to the user via WhatsApp Cloud API."""
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -96,24 +204,20 @@ def send_whatsapp_message(to_number: str, message_body: str) -> None:
         "text": {"body": message_body},
     }
     try:
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        logger.info(f"Message sent to {to_number}: {response.json()}")
-    except requests.exceptions.RequestException as e:
+        response = await post_whatsapp_payload(payload)
+        logger.info(f"Message sent to {to_number}: {response.text}")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error sending WhatsApp message to {to_number}: {e}")
+        logger.error(f"WhatsApp API Error Response: {e.response.text}")
+    except httpx.HTTPError as e:
         logger.error(f"Error sending WhatsApp message to {to_number}: {e}")
-        if response and response.text:
-            logger.error(f"WhatsApp API Error Response: {response.text}")
 
-def send_whatsapp_image(to_number: str, image_url: str, caption: str = None) -> None:
+async def send_whatsapp_image(to_number: str, image_url: str, caption: str = None) -> None:
     """Sends an image message back to the user via WhatsApp Cloud API."""
     if not image_url:
         logger.warning(f"Attempted to send WhatsApp image to {to_number} but image_url was empty.")
         return
 
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -127,13 +231,67 @@ def send_whatsapp_image(to_number: str, image_url: str, caption: str = None) ->
         payload["image"]["caption"] = caption
 
     try:
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        logger.info(f"Image sent to {to_number}: {response.json()}")
-    except requests.exceptions.RequestException as e:
+        response = await post_whatsapp_payload(payload)
+        logger.info(f"Image sent to {to_number}: {response.text}")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error sending WhatsApp image to {to_number} from URL {image_url}: {e}")
+        logger.error(f"WhatsApp API Error Response: {e.response.text}")
+    except httpx.HTTPError as e:
         logger.error(f"Error sending WhatsApp image to {to_number} from URL {image_url}: {e}")
-        if response and response.text:
-            logger.error(f"WhatsApp API Error Response: {response.text}")
+
+
+async def process_user_messages(bot_handler_instance: BotHandler, from_number: str, user_texts: list) -> None:
+    """
+    Handles one user's messages in order, sending each reply as soon as it is ready.
+    The user's handler lock is held throughout, so a later webhook's messages for the same user wait for these.
+    The handler must have been acquired with _acquire_handler; it is released once the messages are handled.
+    """
+    try:
+        async with bot_handler_instance.message_lock:
+            await _process_user_messages_locked(bot_handler_instance, from_number, user_texts)
+    finally:
+        _release_handler(from_number)
+
+
+async def _process_user_messages_locked(bot_handler_instance: BotHandler, from_number: str, user_texts: list) -> None:
+    """process_user_messages' body; the caller holds bot_handler_instance.message_lock."""
+    for user_text in user_texts:
+        response_from_bot_handler = await bot_handler_instance.handle_message(user_text)
+        sends = [send_whatsapp_message(from_number, response_from_bot_handler)]
+
+        # --- NEW: Send Logo after initial LLM selection and greeting ---
+        # This logic should ideally be within bot_handler.py's _personalize_greeting
+        # or _set_llm logic, but for direct testing and simplicity, we'll
+        # add it here to ensure it's sent after the first interaction.
+        # We'll send it if an LLM has just been set or if a lead was found.
+
+        # Check if the bot just finished the initial setup (LLM selected, potentially lead found)
+        # This is a heuristic. A more robust way would be to have BotHandler return a flag.
+        if bot_handler_instance._current_llm and \
+            (bot_handler_instance.crm_state['state'] == ConversationState.LEAD_COLLECTED or \
+             bot_handler_instance.crm_state['state'] == ConversationState.INITIAL): # Initial state after LLM set if no CRM
+
+            logo_url = active_tenant_config.get('branding', {}).get('logo_url')
+            if logo_url:
+                # Sent together with the text message, so the user waits for one round-trip to Meta instead of two
+                sends.append(send_whatsapp_image(from_number, logo_url, caption=f"{active_tenant_config.get('name', 'Your Company')} Logo"))
+                logger.info(f"Sending logo for tenant {active_tenant_config.get('tenant_id', 'N/A')} to {from_number}")
+            else:
+                logger.info(f"No logo URL configured for tenant {active_tenant_config.get('tenant_id', 'N/A')}.")
+
+        await asyncio.gather(*sends)
+
+
+async def process_webhook_messages(messages_by_user: dict) -> None:
+    """Answers different users concurrently so one slow LLM call doesn't hold up the rest."""
+    await asyncio.gather(*(process_user_messages(bot_handler_instance, from_number, user_texts)
+                           for from_number, (bot_handler_instance, user_texts) in messages_by_user.items()))
+
+
+def _log_webhook_failure(future) -> None:
+    """Logs an error that escaped background webhook processing, which would otherwise go unnoticed."""
+    if not future.cancelled() and future.exception():
+        logger.error(f"Error processing WhatsApp webhook messages: {future.exception()}")
 
 
 # --- Flask Webhook Endpoints ---
@@ -161,8 +319,14 @@ def verify_webhook():
 @app.route("/webhook", methods=["POST"])
 def handle_whatsapp_messages():
     """Endpoint for incoming WhatsApp messages."""
-    data = request.get_json()
-    logger.info(f"Received webhook event: {json.dumps(data, indent=2)}")
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        logger.warning("Received webhook event that is not valid JSON; ignoring it.")
+        return "Invalid JSON", 400
+    # Lazy %s formatting: the payload is only rendered when DEBUG logging is on
+    logger.debug("Received webhook event: %s", data)
+    texts_by_user = {} # {user_id: [message texts in arrival order]}
 
     if data and "object" in data and "entry" in data:
         for entry in data["entry"]:
@@ -174,36 +338,16 @@ def handle_whatsapp_messages():
                             user_text = message["text"]["body"]
                             logger.info(f"Message from {from_number}: {user_text}")
 
-                            if from_number not in user_bot_handlers:
-                                # Pass the active_tenant_config to the BotHandler
-                                user_bot_handlers[from_number] = BotHandler(from_number, llm_bots, active_tenant_config)
-                                logger.info(f"New BotHandler created for user: {from_number} with tenant {active_tenant_config.get('tenant_id', 'N/A')}")
-
-                            response_from_bot_handler = user_bot_handlers[from_number].handle_message(user_text)
-                            send_whatsapp_message(from_number, response_from_bot_handler)
-
-                            # --- NEW: Send Logo after initial LLM selection and greeting ---
-                            # This logic should ideally be within bot_handler.py's _personalize_greeting
-                            # or _set_llm logic, but for direct testing and simplicity, we'll
-                            # add it here to ensure it's sent after the first interaction.
-                            # We'll send it if an LLM has just been set or if a lead was found.
-
-                            # Check if the bot just finished the initial setup (LLM selected, potentially lead found)
-                            # This is a heuristic. A more robust way would be to have BotHandler return a flag.
-                            bot_handler_instance = user_bot_handlers[from_number]
-                            if bot_handler_instance._current_llm and \
-                                (bot_handler_instance.crm_state['state'] == 'lead_collected' or \
-                                 bot_handler_instance.crm_state['state'] == 'initial'): # Initial state after LLM set if no CRM
-
-                                logo_url = active_tenant_config.get('branding', {}).get('logo_url')
-                                if logo_url:
-                                    # Send the logo with a small delay or after the text message
-                                    # For simplicity, sending immediately after the text message.
-                                    # WhatsApp will deliver them in order.
-                                    send_whatsapp_image(from_number, logo_url, caption=f"{active_tenant_config.get('name', 'Your Company')} Logo")
-                                    logger.info(f"Sent logo for tenant {active_tenant_config.get('tenant_id', 'N/A')} to {from_number}")
-                                else:
-                                    logger.info(f"No logo URL configured for tenant {active_tenant_config.get('tenant_id', 'N/A')}.")
+                            texts_by_user.setdefault(from_number, []).append(user_text)
+
+    if texts_by_user:
+        # Handlers are only acquired once the whole event is parsed, so a malformed event can't leave one busy
+        messages_by_user = {from_number: (_acquire_handler(from_number), user_texts)
+                            for from_number, user_texts in texts_by_user.items()}
+        # Reply in the background and acknowledge Meta right away: a slow LLM call must not hold the webhook open
+        # long enough for Meta to time out and deliver the same messages again
+        future = asyncio.run_coroutine_threadsafe(process_webhook_messages(messages_by_user), bot_loop)
+        future.add_done_callback(_log_webhook_failure)
 
     return "OK", 200
 
@@ -310,5 +454,9 @@ if __name__ == "__main__":
         logger.error(f"Active tenant '{active_tenant_config.get('tenant_id', 'N/A')}' uses HubSpot, but HubSpot API Key is incomplete in tenants.json. Please configure it via Streamlit UI.")
         exit(1)
 
+    # Development server only. In production run the app under gunicorn (see requirements.txt), e.g.
+    #   gunicorn --workers 1 --threads 32 --worker-class gthread --bind 0.0.0.0:5000 whatsapp_bot_main:app
+    # A single worker process, because user state lives in memory; its threads let webhook requests overlap
+    # while the shared bot loop answers them.
     logger.info("WhatsApp Bot Flask app starting...")
-    app.run(debug=True, port=5000)
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", port=5000, threaded=True)
@@ -1,7 +1,18 @@
 import os
-import requests
-import json
-import time
+import sys
+import functools
+import logging
+
+# This module is imported as a top-level module from console_chatbot/, so make the project root importable
+# for 'console_chatbot.zoho_auth_manager' and the 'utils' package it depends on
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from console_chatbot.zoho_auth_manager import ZohoAuthManager
+from utils.http_session import create_http_session
+
+logger = logging.getLogger(__name__)
 
 # Removed: from dotenv import load_dotenv # Load dotenv only in main entry point
 
@@ -10,24 +21,39 @@ import time
 # ZOHO_CLIENT_SECRET = os.getenv("ZOHO_CLIENT_SECRET")
 # ZOHO_ACCOUNTS_URL = os.getenv("ZOHO_ACCOUNTS_URL")
 
-# Path for the refresh token file relative to this script
+# Tenant id the single-tenant helpers below use with ZohoAuthManager
+DEFAULT_TENANT_ID = "default"
+
+# Path for the refresh token file relative to this script; imported into the manager's token store on first use
 REFRESH_TOKEN_FILE = os.path.join(os.path.dirname(__file__), "zoho_refresh_token.txt")
 
-# In-memory storage for the current access token and its expiry time
-_current_access_token = None
-_access_token_expiry_time = 0 # Unix timestamp when the token expires
+# Keep-alive session for the token calls and zoho_leads' API calls, so requests after the first skip the TLS
+# handshake with Zoho. Token requests are safe to repeat, so POSTs are retried on 429/5xx too; lead creation
+# isn't, so the API base URL gets an adapter that only retries idempotent requests.
+# (requests sends the form Content-Type itself for data=dict bodies.)
+HTTP_SESSION = create_http_session(pool_connections=4, pool_maxsize=16, retry_methods={"POST"})
 
-def _read_refresh_token():
-    """Reads the refresh token from the local file."""
-    if os.path.exists(REFRESH_TOKEN_FILE):
-        with open(REFRESH_TOKEN_FILE, 'r') as f:
-            return f.read().strip()
-    return None
+@functools.cache
+def _get_zoho_credentials():
+    """
+    Returns (client_id, client_secret, accounts_url) from the environment.
+    They are read on the first call rather than at import, as the main app loads .env after importing this
+    module, and then kept for the rest of the process.
+    """
+    return os.getenv("ZOHO_CLIENT_ID"), os.getenv("ZOHO_CLIENT_SECRET"), os.getenv("ZOHO_ACCOUNTS_URL")
 
-def _save_refresh_token(token: str):
-    """Saves the refresh token to the local file."""
-    with open(REFRESH_TOKEN_FILE, 'w') as f:
-        f.write(token)
+@functools.cache
+def get_default_auth_manager() -> ZohoAuthManager:
+    """
+    Returns the process-wide ZohoAuthManager for the single-tenant setup configured by the ZOHO_* environment
+    variables. Going through the manager means these tokens share its cache and per-tenant refresh lock, so
+    single-tenant and multi-tenant callers never refresh the same token separately.
+    """
+    zoho_client_id, zoho_client_secret, zoho_accounts_url = _get_zoho_credentials()
+    auth_manager = ZohoAuthManager(zoho_client_id, zoho_client_secret, zoho_accounts_url, os.getenv("ZOHO_API_URL"),
+                                   DEFAULT_TENANT_ID, http_session=HTTP_SESSION)
+    auth_manager.refresh_token_file = REFRESH_TOKEN_FILE
+    return auth_manager
 
 def get_access_token():
     """
@@ -36,134 +62,33 @@ def get_access_token():
     Returns:
         str: A valid Zoho CRM access token, or None if refresh fails.
     """
-    global _current_access_token, _access_token_expiry_time
-
-    # Check if the current token is still valid
-    if _current_access_token and time.time() < _access_token_expiry_time:
-        return _current_access_token
-
-    # Try to get refresh token from file
-    zoho_refresh_token_from_file = _read_refresh_token()
-
-    # Get credentials from environment (loaded by main app)
-    zoho_client_id = os.getenv("ZOHO_CLIENT_ID")
-    zoho_client_secret = os.getenv("ZOHO_CLIENT_SECRET")
-    zoho_accounts_url = os.getenv("ZOHO_ACCOUNTS_URL")
-
-    if not all([zoho_client_id, zoho_client_secret, zoho_refresh_token_from_file, zoho_accounts_url]):
-        print("[Zoho Auth ERROR] Missing Zoho credentials or refresh token. Cannot generate access token.")
-        return None
-
-    print("[Zoho Auth] Access token expired or not found. Attempting to refresh...")
-    token_url = f"{zoho_accounts_url}/oauth/v2/token"
-    payload = {
-        "refresh_token": zoho_refresh_token_from_file,
-        "client_id": zoho_client_id,
-        "client_secret": zoho_client_secret,
-        "grant_type": "refresh_token"
-    }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    try:
-        response = requests.post(token_url, data=payload, headers=headers)
-        response.raise_for_status()
-        token_data = response.json()
-
-        if "access_token" in token_data:
-            _current_access_token = token_data["access_token"]
-            _access_token_expiry_time = time.time() + token_data.get("expires_in", 3600) - 60
-            print("[Zoho Auth] Successfully refreshed access token.")
-            return _current_access_token
-        else:
-            print(f"[Zoho Auth ERROR] Failed to get access token: {token_data.get('error', 'Unknown error')}")
-            print(f"[Zoho Auth ERROR] Full Zoho Response: {json.dumps(token_data, indent=2)}")
-            return None
-
-    except requests.exceptions.RequestException as e:
-        print(f"[Zoho Auth ERROR] Network or HTTP error during token refresh: {e}")
-        return None
-    except json.JSONDecodeError:
-        print(f"[Zoho Auth ERROR] Invalid JSON response from Zoho: {response.text}")
-        return None
-    except Exception as e:
-        print(f"[Zoho Auth ERROR] An unexpected error occurred during token refresh: {e}")
-        return None
+    return get_default_auth_manager().get_access_token()
 
 def exchange_authorization_code_for_tokens(auth_code: str, redirect_uri: str) -> bool:
     """
     Exchanges an authorization code for access and refresh tokens.
-    Saves the refresh token to a file.
+    Saves the refresh token to the manager's token store.
     Args:
         auth_code (str): The authorization code received from Zoho.
         redirect_uri (str): The redirect URI used in the authorization request.
     Returns:
         bool: True if tokens are successfully obtained and refresh token saved, False otherwise.
     """
-    zoho_client_id = os.getenv("ZOHO_CLIENT_ID")
-    zoho_client_secret = os.getenv("ZOHO_CLIENT_SECRET")
-    zoho_accounts_url = os.getenv("ZOHO_ACCOUNTS_URL")
-
-    if not all([zoho_client_id, zoho_client_secret, zoho_accounts_url]):
-        print("[Zoho Auth ERROR] Missing Zoho credentials in .env. Cannot exchange authorization code.")
+    if not all(_get_zoho_credentials()):
+        logger.error("[Zoho Auth ERROR] Missing Zoho credentials in .env. Cannot exchange authorization code.")
         return False
 
-    token_url = f"{zoho_accounts_url}/oauth/v2/token"
-    payload = {
-        "code": auth_code,
-        "client_id": zoho_client_id,
-        "client_secret": zoho_client_secret,
-        "redirect_uri": redirect_uri,
-        "grant_type": "authorization_code"
-    }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    try:
-        print("[Zoho Auth] Exchanging authorization code for tokens...")
-        response = requests.post(token_url, data=payload, headers=headers)
-        response.raise_for_status()
-        token_data = response.json()
-
-        if "refresh_token" in token_data:
-            _save_refresh_token(token_data["refresh_token"])
-            print("[Zoho Auth] Refresh token saved to zoho_refresh_token.txt")
-            return True
-        else:
-            print(f"[Zoho Auth ERROR] Failed to get refresh token: {token_data.get('error', 'Unknown error')}")
-            print(f"[Zoho Auth ERROR] Full Zoho Response: {json.dumps(token_data, indent=2)}")
-            return False
-
-    except requests.exceptions.RequestException as e:
-        print(f"[Zoho Auth ERROR] Network or HTTP error during code exchange: {e}")
-        return False
-    except json.JSONDecodeError:
-        print(f"[Zoho Auth ERROR] Invalid JSON response from Zoho: {response.text}")
-        return False
-    except Exception as e:
-        print(f"[Zoho Auth ERROR] An unexpected error occurred during code exchange: {e}")
-        return False
+    return get_default_auth_manager().exchange_authorization_code_for_tokens(auth_code, redirect_uri)
 
 # --- Test function for direct execution (for debugging) ---
 if __name__ == "__main__":
     print("--- Testing Zoho Access Token Refresh ---")
     # For testing this script directly, you might temporarily load dotenv here
     # load_dotenv()
-    # ZOHO_CLIENT_ID = os.getenv("ZOHO_CLIENT_ID")
-    # ZOHO_CLIENT_SECRET = os.getenv("ZOHO_CLIENT_SECRET")
-    # ZOHO_ACCOUNTS_URL = os.getenv("ZOHO_ACCOUNTS_URL")
-
-    # print(f"Client ID: {ZOHO_CLIENT_ID}")
-    # print(f"Client Secret: {ZOHO_CLIENT_SECRET[:5]}...{ZOHO_CLIENT_SECRET[-5:]}")
-    # print(f"Accounts URL: {ZOHO_ACCOUNTS_URL}")
-    # print(f"Refresh Token from file: {_read_refresh_token()[:5]}...{_read_refresh_token()[-5:]}" if _read_refresh_token() else "None")
-
-    # if not all([ZOHO_CLIENT_ID, ZOHO_CLIENT_SECRET, _read_refresh_token(), ZOHO_ACCOUNTS_URL]):
-    #     print("ERROR: One or more Zoho environment variables or refresh token are missing. Please check your .env file and ensure zoho_refresh_token.txt exists.")
+    # token = get_access_token()
+    # if token:
+    #     print(f"\nSUCCESS: Obtained access token: {token[:30]}...")
     # else:
-    #     token = get_access_token()
-    #     if token:
-    #         print(f"\nSUCCESS: Obtained access token: {token[:30]}...")
-    #     else:
-    #         print("\nFAILURE: Could not obtain access token. Check the errors above.")
+    #     print("\nFAILURE: Could not obtain access token. Check the errors above.")
     print("This script is designed to be imported. Run whatsapp_bot_main.py to test full flow.")
     print("-----------------------------------------")
-
@@ -1,43 +1,125 @@
 import os
 import requests
-import json
+import orjson
 import time
 import logging
+import threading
+import functools
+
+from utils.http_session import create_http_session
+from utils.token_store import RefreshTokenStore
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Default keep-alive session for token calls, so refreshes after the first skip the TLS handshake with the
+# Zoho accounts server. Token requests are safe to repeat, so POSTs are retried on 429/5xx too.
+# (requests sends the form Content-Type itself for data=dict bodies.)
+_TOKEN_SESSION = create_http_session(pool_connections=4, pool_maxsize=16, retry_methods={"POST"})
+
+# Access tokens shared by every ZohoAuthManager in the process, keyed by tenant_id, so a new manager (one is
+# built per CRMRouter, i.e. whenever a tenant's config changes) reuses its tenant's token instead of refreshing it. Values are
+# (access_token, expires_at); expires_at is checked too, as Zoho may issue tokens shorter than the cache TTL.
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=3600) # Zoho tokens last at most an hour
+_REFRESH_LOCKS = {} # {tenant_id: threading.Lock}, held while that tenant's token is being refreshed
+
+# Tenants whose refresh token Zoho just rejected: their token requests fail at once, without a round-trip to
+# Zoho, until the entry expires (ZOHO_INVALID_TOKEN_TTL seconds) or the tenant is authorized again
+_INVALID_TENANTS = TTLCache(maxsize=1000, ttl=float(os.getenv("ZOHO_INVALID_TOKEN_TTL", "60")))
+
+# Refresh tokens of all tenants live in one SQLite database (ZOHO_TOKEN_DB) instead of a file per tenant
+_REFRESH_TOKEN_DB = os.getenv("ZOHO_TOKEN_DB", "zoho_refresh_tokens.db")
+
+@functools.cache
+def _refresh_token_store() -> RefreshTokenStore:
+    """Returns the process-wide refresh token store, opening the database on first use."""
+    return RefreshTokenStore(_REFRESH_TOKEN_DB)
+
+# Tokens of tenants active in the last hour are refreshed in the background shortly before they expire, so
+# requests keep finding a valid token instead of the first one after expiry waiting for the refresh
+_PREEMPTIVE_REFRESH_INTERVAL = 60 # Seconds between background scans
+_PREEMPTIVE_REFRESH_WINDOW = 120 # Tokens expiring within this many seconds are refreshed
+_ACTIVE_TENANTS = TTLCache(maxsize=10_000, ttl=3600) # {tenant_id: ZohoAuthManager last used for it}
+_refresher_lock = threading.Lock()
+_refresher_thread = None
+
+def _token_expires_soon(tenant_id: str) -> bool:
+    """Tells whether the tenant has a cached token that is about to expire."""
+    cached_token = _TOKEN_CACHE.get(tenant_id)
+    return bool(cached_token) and cached_token[1] - time.time() < _PREEMPTIVE_REFRESH_WINDOW
+
+def _refresh_expiring_tokens_forever() -> None:
+    """Background loop: refreshes the tokens of recently active tenants that are about to expire."""
+    while True:
+        time.sleep(_PREEMPTIVE_REFRESH_INTERVAL)
+        for tenant_id, auth_manager in _ACTIVE_TENANTS.items():
+            if not _token_expires_soon(tenant_id):
+                continue
+            with _REFRESH_LOCKS.setdefault(tenant_id, threading.Lock()):
+                if _token_expires_soon(tenant_id): # A request may have refreshed it meanwhile
+                    logger.info(f"[ZohoAuthManager] Refreshing access token for tenant {tenant_id} before it expires.")
+                    auth_manager._refresh_access_token()
+
+def _start_background_refresher() -> None:
+    """Starts the background token refresher thread, once per process."""
+    global _refresher_thread
+    with _refresher_lock:
+        if _refresher_thread is None:
+            _refresher_thread = threading.Thread(target=_refresh_expiring_tokens_forever,
+                                                 name="zoho-token-refresher", daemon=True)
+            _refresher_thread.start()
+
 class ZohoAuthManager:
     """
     Manages Zoho CRM OAuth2 authentication for a specific tenant.
-    Handles access token retrieval and refresh using a tenant-specific refresh token file.
+    Handles access token retrieval and refresh using the tenant's refresh token from the shared token store.
     """
-    def __init__(self, client_id: str, client_secret: str, accounts_url: str, api_url: str, tenant_id: str):
+    def __init__(self, client_id: str, client_secret: str, accounts_url: str, api_url: str, tenant_id: str,
+                 http_session: requests.Session = None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.accounts_url = accounts_url
         self.api_url = api_url # Not directly used in auth, but useful for context
         self.tenant_id = tenant_id
-        self.refresh_token_file = f"zoho_refresh_token_{self.tenant_id}.txt"
+        self.refresh_token_file = f"zoho_refresh_token_{self.tenant_id}.txt" # Legacy per-tenant file, imported on first load
+        # Session for the token calls; callers can pass the one their CRM API calls use to share its pools
+        self.http_session = http_session or _TOKEN_SESSION
+        # Built once, as they only change with the credentials
+        self._token_url = f"{self.accounts_url}/oauth/v2/token"
+        self._refresh_payload_template = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "refresh_token"
+        }
 
-        self._current_access_token = None
-        self._access_token_expiry_time = 0 # Unix timestamp when the token expires
         logger.info(f"[ZohoAuthManager] Initialized for tenant: {tenant_id}")
 
     def _load_refresh_token(self) -> str | None:
-        """Loads refresh token from the tenant-specific file."""
+        """
+        Loads the tenant's refresh token from the token store.
+        A token still kept in the legacy tenant-specific file is moved into the store the first time.
+        """
+        token = _refresh_token_store().get(self.tenant_id)
+        if token:
+            return token
+
         if os.path.exists(self.refresh_token_file):
             with open(self.refresh_token_file, "r") as f:
                 token = f.read().strip()
-                logger.debug(f"[ZohoAuthManager] Loaded refresh token from {self.refresh_token_file}")
+            if token:
+                _refresh_token_store().set(self.tenant_id, token)
+                logger.info(f"[ZohoAuthManager] Imported refresh token for tenant {self.tenant_id} from {self.refresh_token_file}")
                 return token
-        logger.warning(f"[ZohoAuthManager] No refresh token file found for tenant {self.tenant_id} at {self.refresh_token_file}")
+
+        logger.warning(f"[ZohoAuthManager] No refresh token stored for tenant {self.tenant_id} in {_REFRESH_TOKEN_DB}")
         return None
 
     def _save_refresh_token(self, token: str):
-        """Saves refresh token to the tenant-specific file."""
-        with open(self.refresh_token_file, "w") as f:
-            f.write(token)
-        logger.info(f"[ZohoAuthManager] Refresh token saved for tenant {self.tenant_id} to {self.refresh_token_file}")
+        """Saves the tenant's refresh token to the token store, unless it is the token already stored."""
+        if _refresh_token_store().set(self.tenant_id, token):
+            logger.info(f"[ZohoAuthManager] Refresh token saved for tenant {self.tenant_id} to {_REFRESH_TOKEN_DB}")
+        else:
+            logger.debug(f"[ZohoAuthManager] Refresh token for tenant {self.tenant_id} unchanged; nothing saved.")
 
     def get_access_token(self) -> str | None:
         """
@@ -46,11 +128,42 @@ class ZohoAuthManager:
         Returns:
             str: A valid Zoho CRM access token, or None if refresh fails.
         """
-        # Check if the current token is still valid
-        if self._current_access_token and time.time() < self._access_token_expiry_time:
+        if _INVALID_TENANTS.get(self.tenant_id):
+            logger.debug(f"[ZohoAuthManager] Refresh token for tenant {self.tenant_id} was rejected recently; not retrying yet.")
+            return None
+
+        # Check if the tenant's current token is still valid
+        access_token = self.get_cached_access_token()
+        if access_token:
+            return access_token
+
+        # Only one thread per tenant refreshes; the others wait for it and then find its token in the cache
+        # (checked again under the lock), instead of all posting to Zoho at once when the token expires
+        with _REFRESH_LOCKS.setdefault(self.tenant_id, threading.Lock()):
+            return self._cached_access_token() or self._refresh_access_token()
+
+    def get_cached_access_token(self) -> str | None:
+        """
+        Returns the tenant's access token if a valid one is cached, otherwise None; it never refreshes the token,
+        so it doesn't block on Zoho and can be called from an event loop. Call get_access_token() on None.
+        """
+        _ACTIVE_TENANTS.set(self.tenant_id, self) # Keeps the background refresher renewing this tenant's token
+        return self._cached_access_token()
+
+    def _cached_access_token(self) -> str | None:
+        """Returns the tenant's cached access token if it is still valid, otherwise None."""
+        cached_token = _TOKEN_CACHE.get(self.tenant_id)
+        if cached_token and time.time() < cached_token[1]:
             logger.debug(f"[ZohoAuthManager] Using cached access token for tenant {self.tenant_id}.")
-            return self._current_access_token
+            return cached_token[0]
+        return None
 
+    def _refresh_access_token(self) -> str | None:
+        """
+        Gets a new access token with the tenant's refresh token and caches it.
+        Returns:
+            str: The new access token, or None if refresh fails.
+        """
         refresh_token = self._load_refresh_token()
 
         if not refresh_token:
@@ -62,40 +175,37 @@ class ZohoAuthManager:
             logger.error(f"[ZohoAuthManager ERROR] Missing Zoho credentials for tenant {self.tenant_id}. Cannot generate access token.")
             return None
 
-        token_url = f"{self.accounts_url}/oauth/v2/token"
-        payload = {
-            "refresh_token": refresh_token,
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "grant_type": "refresh_token"
-        }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        payload = self._refresh_payload_template | {"refresh_token": refresh_token}
 
         try:
-            response = requests.post(token_url, data=payload, headers=headers)
+            response = self.http_session.post(self._token_url, data=payload)
             response.raise_for_status() # Raise an exception for HTTP errors
-            token_data = response.json()
+            token_data = orjson.loads(response.content)
 
             if "access_token" in token_data:
-                self._current_access_token = token_data["access_token"]
                 # Zoho access tokens typically last 3600 seconds (1 hour)
-                self._access_token_expiry_time = time.time() + token_data.get("expires_in", 3600) - 60 # Subtract 60s buffer
+                expires_at = time.time() + token_data.get("expires_in", 3600) - 60 # Subtract 60s buffer
+                _TOKEN_CACHE.set(self.tenant_id, (token_data["access_token"], expires_at))
+                _start_background_refresher()
                 logger.info(f"[ZohoAuthManager] Successfully refreshed access token for tenant {self.tenant_id}.")
-                return self._current_access_token
+                return token_data["access_token"]
             else:
                 logger.error(f"[ZohoAuthManager ERROR] Failed to get access token for tenant {self.tenant_id}: {token_data.get('error', 'Unknown error')}")
-                logger.error(f"[ZohoAuthManager ERROR] Full Zoho Response: {json.dumps(token_data, indent=2)}")
+                logger.debug("[ZohoAuthManager] Full Zoho Response: %s", token_data) # Only formatted when DEBUG is on
                 # If refresh token is invalid, delete it so next time it prompts for re-auth
                 if token_data.get('error') == 'invalid_code' or token_data.get('error') == 'invalid_grant':
-                    logger.warning(f"[ZohoAuthManager] Invalid refresh token detected for tenant {self.tenant_id}. Deleting local token file.")
-                    if os.path.exists(self.refresh_token_file):
+                    logger.warning(f"[ZohoAuthManager] Invalid refresh token detected for tenant {self.tenant_id}. Deleting stored token.")
+                    _TOKEN_CACHE.pop(self.tenant_id)
+                    _INVALID_TENANTS.set(self.tenant_id, True)
+                    _refresh_token_store().delete(self.tenant_id)
+                    if os.path.exists(self.refresh_token_file): # Or it would be imported again
                         os.remove(self.refresh_token_file)
                 return None
 
         except requests.exceptions.RequestException as e:
             logger.error(f"[ZohoAuthManager ERROR] Network or HTTP error during token refresh for tenant {self.tenant_id}: {e}")
             return None
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error(f"[ZohoAuthManager ERROR] Invalid JSON response from Zoho for tenant {self.tenant_id}: {response.text}")
             return None
         except Exception as e:
@@ -105,14 +215,13 @@ class ZohoAuthManager:
     def exchange_authorization_code_for_tokens(self, auth_code: str, redirect_uri: str) -> bool:
         """
         Exchanges an authorization code for access and refresh tokens.
-        Saves the refresh token to a tenant-specific file.
+        Saves the refresh token to the token store.
         Args:
             auth_code (str): The authorization code received from Zoho.
             redirect_uri (str): The redirect URI used in the authorization request.
         Returns:
             bool: True if successful, False otherwise.
         """
-        token_url = f"{self.accounts_url}/oauth/v2/token"
         payload = {
             "code": auth_code,
             "client_id": self.client_id,
@@ -120,30 +229,30 @@ class ZohoAuthManager:
             "redirect_uri": redirect_uri,
             "grant_type": "authorization_code"
         }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
         try:
             logger.info(f"[ZohoAuthManager] Exchanging authorization code for tokens for tenant {self.tenant_id}...")
-            response = requests.post(token_url, data=payload, headers=headers)
+            response = self.http_session.post(self._token_url, data=payload)
             response.raise_for_status()
-            token_data = response.json()
+            token_data = orjson.loads(response.content)
 
             if "refresh_token" in token_data and "access_token" in token_data:
                 self._save_refresh_token(token_data["refresh_token"])
-                # Also set the current access token for immediate use
-                self._current_access_token = token_data["access_token"]
-                self._access_token_expiry_time = time.time() + token_data.get("expires_in", 3600) - 60
+                _INVALID_TENANTS.pop(self.tenant_id) # Re-authorized, so token requests may go to Zoho again
+                # Also cache the access token for immediate use
+                expires_at = time.time() + token_data.get("expires_in", 3600) - 60
+                _TOKEN_CACHE.set(self.tenant_id, (token_data["access_token"], expires_at))
                 logger.info(f"[ZohoAuthManager] Successfully obtained and saved refresh token for tenant {self.tenant_id}.")
                 return True
             else:
                 logger.error(f"[ZohoAuthManager ERROR] Failed to exchange code for tokens for tenant {self.tenant_id}: {token_data.get('error', 'Unknown error')}")
-                logger.error(f"[ZohoAuthManager ERROR] Full Zoho Response: {json.dumps(token_data, indent=2)}")
+                logger.debug("[ZohoAuthManager] Full Zoho Response: %s", token_data) # Only formatted when DEBUG is on
                 return False
 
         except requests.exceptions.RequestException as e:
             logger.error(f"[ZohoAuthManager ERROR] Network or HTTP error during code exchange for tenant {self.tenant_id}: {e}")
             return False
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error(f"[ZohoAuthManager ERROR] Invalid JSON response from Zoho during code exchange for tenant {self.tenant_id}: {response.text}")
             return False
         except Exception as e:
@@ -1,28 +1,48 @@
 import requests
-import json
-import os
-from dotenv import load_dotenv
-from zoho_auth import get_access_token # Import the auth function
+import orjson
+import functools
+import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from zoho_auth import HTTP_SESSION, get_default_auth_manager # Import the default auth manager and its keep-alive session
+from console_chatbot.zoho_auth_manager import ZohoAuthManager
 
-load_dotenv()
-ZOHO_API_URL = os.getenv("ZOHO_API_URL")
+logger = logging.getLogger(__name__)
 
-def search_lead_by_phone(phone_number: str) -> dict | None:
+# The environment (.env) is loaded by the main entry point; the API URL comes from the auth manager in use,
+# whose default is read from ZOHO_API_URL on first use
+
+@functools.cache
+def _prepare_api_url(api_url: str) -> str:
+    """
+    Mounts the retry policy for api_url on the shared session, once per URL, and returns the URL.
+    API calls share the auth session's pooled connections, but creating a lead isn't safe to repeat,
+    so only idempotent API requests are retried.
+    """
+    if api_url:
+        HTTP_SESSION.mount(api_url, HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)))
+    return api_url
+
+def search_lead_by_phone(phone_number: str, auth_manager: ZohoAuthManager = None) -> dict | None:
     """
     Searches for a lead in Zoho CRM by phone number.
     Args:
         phone_number (str): The phone number to search for.
+        auth_manager (ZohoAuthManager, optional): Supplies the access token and API URL; defaults to the
+            single-tenant manager.
     Returns:
         dict | None: The lead record if found, otherwise None.
     """
-    access_token = get_access_token()
+    auth_manager = auth_manager or get_default_auth_manager()
+    access_token = auth_manager.get_access_token()
     if not access_token:
-        print("[Zoho Leads ERROR] Could not get access token for searching leads.")
+        logger.error("[Zoho Leads ERROR] Could not get access token for searching leads.")
         return None
 
     # Zoho CRM API for searching records (CRM.coql module or search endpoint)
     # Using search records endpoint for simplicity
-    search_url = f"{ZOHO_API_URL}/crm/v2/Leads/search"
+    search_url = f"{_prepare_api_url(auth_manager.api_url)}/crm/v2/Leads/search"
     headers = {
         "Authorization": f"Zoho-oauthtoken {access_token}"
     }
@@ -31,31 +51,32 @@ def search_lead_by_phone(phone_number: str) -> dict | None:
     }
 
     try:
-        print(f"[Zoho Leads] Searching for lead with phone: {phone_number}")
-        response = requests.get(search_url, headers=headers, params=params)
+        logger.info(f"[Zoho Leads] Searching for lead with phone: {phone_number}")
+        response = HTTP_SESSION.get(search_url, headers=headers, params=params)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
 
         if data.get('data') and len(data['data']) > 0:
-            print(f"[Zoho Leads] Lead found: {data['data'][0].get('Full_Name', 'Unknown')}")
+            logger.info(f"[Zoho Leads] Lead found: {data['data'][0].get('Full_Name', 'Unknown')}")
             return data['data'][0] # Return the first lead found
         else:
-            print(f"[Zoho Leads] No lead found for phone: {phone_number}")
+            logger.info(f"[Zoho Leads] No lead found for phone: {phone_number}")
             return None
 
     except requests.exceptions.RequestException as e:
-        print(f"[Zoho Leads ERROR] HTTP error during lead search: {e}")
+        logger.error(f"[Zoho Leads ERROR] HTTP error during lead search: {e}")
         if response and response.text:
-            print(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
+            logger.error(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
         return None
-    except json.JSONDecodeError:
-        print(f"[Zoho Leads ERROR] Invalid JSON response during lead search: {response.text}")
+    except orjson.JSONDecodeError:
+        logger.error(f"[Zoho Leads ERROR] Invalid JSON response during lead search: {response.text}")
         return None
     except Exception as e:
-        print(f"[Zoho Leads ERROR] An unexpected error occurred during lead search: {e}")
+        logger.error(f"[Zoho Leads ERROR] An unexpected error occurred during lead search: {e}")
         return None
 
-def create_lead(first_name: str, email: str, phone: str, last_name: str = None) -> dict | None:
+def create_lead(first_name: str, email: str, phone: str, last_name: str = None,
+                auth_manager: ZohoAuthManager = None) -> dict | None:
     """
     Creates a new lead in Zoho CRM.
     Args:
@@ -63,12 +84,15 @@ def create_lead(first_name: str, email: str, phone: str, last_name: str = None)
         email (str): The email of the lead.
         phone (str): The phone number of the lead.
         last_name (str, optional): The last name of the lead. If None, derived from first_name.
+        auth_manager (ZohoAuthManager, optional): Supplies the access token and API URL; defaults to the
+            single-tenant manager.
     Returns:
         dict | None: The created lead record if successful, otherwise None.
     """
-    access_token = get_access_token()
+    auth_manager = auth_manager or get_default_auth_manager()
+    access_token = auth_manager.get_access_token()
     if not access_token:
-        print("[Zoho Leads ERROR] Could not get access token for creating lead.")
+        logger.error("[Zoho Leads ERROR] Could not get access token for creating lead.")
         return None
 
     # Derive last_name if not provided
@@ -86,7 +110,7 @@ def create_lead(first_name: str, email: str, phone: str, last_name: str = None)
         derived_last_name = last_name
         first_name_for_zoho = first_name
 
-    create_url = f"{ZOHO_API_URL}/crm/v2/Leads"
+    create_url = f"{_prepare_api_url(auth_manager.api_url)}/crm/v2/Leads"
     headers = {
         "Authorization": f"Zoho-oauthtoken {access_token}",
         "Content-Type": "application/json"
@@ -106,30 +130,30 @@ def create_lead(first_name: str, email: str, phone: str, last_name: str = None)
     }
 
     try:
-        print(f"[Zoho Leads] Creating new lead: {first_name_for_zoho} {derived_last_name} ({phone})")
-        response = requests.post(create_url, headers=headers, json=lead_data)
+        logger.info(f"[Zoho Leads] Creating new lead: {first_name_for_zoho} {derived_last_name} ({phone})")
+        response = HTTP_SESSION.post(create_url, headers=headers, data=orjson.dumps(lead_data))
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
 
         if data.get('data') and len(data['data']) > 0 and data['data'][0].get('status') == 'success':
             created_lead_id = data['data'][0]['details']['id']
-            print(f"[Zoho Leads] Lead created successfully with ID: {created_lead_id}")
+            logger.info(f"[Zoho Leads] Lead created successfully with ID: {created_lead_id}")
             return data['data'][0]['details']
         else:
-            print(f"[Zoho Leads ERROR] Failed to create lead: {data.get('message', 'Unknown error')}")
+            logger.error(f"[Zoho Leads ERROR] Failed to create lead: {data.get('message', 'Unknown error')}")
             if response and response.text:
-                print(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
+                logger.error(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
             return None
 
     except requests.exceptions.RequestException as e:
-        print(f"[Zoho Leads ERROR] HTTP error during lead creation: {e}")
+        logger.error(f"[Zoho Leads ERROR] HTTP error during lead creation: {e}")
         if response and response.text:
-            print(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
+            logger.error(f"[Zoho Leads ERROR] Zoho API Response: {response.text}")
         return None
-    except json.JSONDecodeError:
-        print(f"[Zoho Leads ERROR] Invalid JSON response during lead creation: {response.text}")
+    except orjson.JSONDecodeError:
+        logger.error(f"[Zoho Leads ERROR] Invalid JSON response during lead creation: {response.text}")
         return None
     except Exception as e:
-        print(f"[Zoho Leads ERROR] An unexpected error occurred during lead creation: {e}")
+        logger.error(f"[Zoho Leads ERROR] An unexpected error occurred during lead creation: {e}")
         return None
 
@@ -1,13 +1,57 @@
+import asyncio
+import copy
 import json
 import os
 import logging
+import threading
 from integrations.zoho_crm import ZohoCRM
 from integrations.hubspot_crm import HubSpotCRM
 from console_chatbot.zoho_auth_manager import ZohoAuthManager # Import the new ZohoAuthManager
+from utils.http_session import create_http_session
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive session shared by every router's CRM calls (Zoho auth and API, HubSpot API): one connection pool per
+# host (accounts.* for tokens, www.zohoapis.* for data, per Zoho data centre; api.hubapi.com), so each CRM call after the first reuses
+# a warm TLS connection. pool_maxsize covers a full asyncio.to_thread pool (at most 32 threads) calling one host,
+# with headroom; HTTP_POOL_MAXSIZE raises it for larger deployments.
+_CRM_HTTP_SESSION = create_http_session(pool_connections=16, pool_maxsize=64)
+
+# Recent lead searches, keyed by (tenant_id, phone digits), so a user sending several messages in a row is looked
+# up once rather than on every message. Misses are kept for a shorter time, as the lead may be created elsewhere.
+_LEAD_SEARCH_CACHE = TTLCache(maxsize=10_000, ttl=300) # {key: lead record}
+_LEAD_MISS_CACHE = TTLCache(maxsize=10_000, ttl=30) # {key: True}
+# Numbers with fewer digits than this (empty or junk input) are never searched for; the search is a miss
+_MIN_PHONE_DIGITS = 7
+
+# Routers shared by all users of a tenant, as {tenant_id: (tenant config they were built from, CRMRouter)}
+_ROUTERS = {}
+_ROUTERS_LOCK = threading.Lock()
+
 class CRMRouter:
+    @classmethod
+    def for_tenant(cls, active_tenant_config: dict) -> "CRMRouter":
+        """
+        Returns the process-wide router for the tenant, building it on first use, so its CRM client and
+        auth manager are reused across requests instead of rebuilt for every user.
+        A router built from an older version of the tenant's configuration is replaced.
+        Args:
+            active_tenant_config (dict): The tenant's configuration from tenants.json.
+        Returns:
+            CRMRouter: The tenant's router.
+        """
+        tenant_id = active_tenant_config.get('tenant_id', 'default_tenant')
+        with _ROUTERS_LOCK:
+            cached = _ROUTERS.get(tenant_id)
+            if cached and cached[0] == active_tenant_config:
+                return cached[1]
+            router = cls(active_tenant_config)
+            # Snapshot the config, so an in-place edit of the caller's dict still counts as a change.
+            # dict() first, as read-only views from tenant_loader (MappingProxyType) can't be deep-copied.
+            _ROUTERS[tenant_id] = (copy.deepcopy(dict(active_tenant_config)), router)
+            return router
+
     def __init__(self, active_tenant_config: dict):
         self.active_tenant_config = active_tenant_config
         self.active_crm_name = active_tenant_config.get('crm')
@@ -35,16 +79,19 @@ class CRMRouter:
                 client_secret=zoho_config['client_secret'],
                 accounts_url=zoho_config['accounts_url'],
                 api_url=zoho_config['api_url'], # Pass api_url for context, though auth manager doesn't use it directly
-                tenant_id=self.tenant_id
+                tenant_id=self.tenant_id,
+                http_session=_CRM_HTTP_SESSION
             )
-            self.crm_instances['zoho'] = ZohoCRM(auth_manager=zoho_auth_manager, api_url=zoho_config['api_url'])
+            self.crm_instances['zoho'] = ZohoCRM(auth_manager=zoho_auth_manager, api_url=zoho_config['api_url'],
+                                                 http_session=_CRM_HTTP_SESSION)
 
         elif self.active_crm_name == 'hubspot':
             hubspot_config = self.active_tenant_config.get('hubspot', {})
             if not hubspot_config.get('api_key'):
                 logger.error(f"HubSpot API Key incomplete for tenant {self.tenant_id}. HubSpot CRM will not be initialized.")
                 return
-            self.crm_instances['hubspot'] = HubSpotCRM(api_key=hubspot_config['api_key'], tenant_id=self.tenant_id)
+            self.crm_instances['hubspot'] = HubSpotCRM(api_key=hubspot_config['api_key'], tenant_id=self.tenant_id,
+                                                     http_session=_CRM_HTTP_SESSION)
 
         else:
             logger.error(f"Unsupported active CRM '{self.active_crm_name}' for tenant {self.tenant_id}.")
@@ -62,18 +109,146 @@ class CRMRouter:
         crm_instance = self.get_active_crm_instance()
         if crm_instance:
             logger.info(f"[CRMRouter] Routing lead creation to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
-            return crm_instance.create_lead(normalized_lead_data)
+            created_lead = crm_instance.create_lead(normalized_lead_data)
+            if created_lead:
+                self._forget_search(normalized_lead_data.get('phone'))
+            return created_lead
         logger.warning(f"[CRMRouter] No active CRM to create lead for tenant {self.tenant_id}.")
         return None
 
     def search_lead(self, phone_number: str) -> dict | None:
         """
         Routes the phone number to the active CRM for lead search.
+        A found record always carries a 'display_name' key, whichever CRM it came from.
+        """
+        crm_instance = self.get_active_crm_instance()
+        if crm_instance:
+            cache_key = self._search_cache_key(phone_number)
+            found, lead_record = self._cached_search(cache_key)
+            if found:
+                return lead_record
+            logger.info(f"[CRMRouter] Routing lead search to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
+            return self._cache_search(cache_key, self._with_display_name(crm_instance.search_lead(phone_number)))
+        logger.warning(f"[CRMRouter] No active CRM to search lead for tenant {self.tenant_id}.")
+        return None
+
+    def create_leads(self, normalized_leads: list[dict]) -> list[dict | None]:
+        """
+        Routes a bulk lead creation (e.g. an import) to the active CRM, batched when the CRM supports it.
+        Returns:
+            list[dict | None]: For each input, in order, the created record, or None if it wasn't created.
+        """
+        crm_instance = self.get_active_crm_instance()
+        if not crm_instance:
+            logger.warning(f"[CRMRouter] No active CRM to create leads for tenant {self.tenant_id}.")
+            return [None] * len(normalized_leads)
+
+        logger.info(f"[CRMRouter] Routing creation of {len(normalized_leads)} leads to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
+        if hasattr(crm_instance, 'create_leads'):
+            created_leads = crm_instance.create_leads(normalized_leads)
+        else:
+            created_leads = [crm_instance.create_lead(lead_data) for lead_data in normalized_leads]
+        for lead_data, created_lead in zip(normalized_leads, created_leads):
+            if created_lead:
+                self._forget_search(lead_data.get('phone'))
+        return created_leads
+
+    def search_leads(self, phone_numbers: list[str]) -> dict[str, dict]:
+        """
+        Routes a bulk lead search (e.g. deduplicating an import) to the active CRM, batched when the CRM supports it.
+        Returns:
+            dict[str, dict]: The lead found for each phone number, each with a 'display_name' key;
+            numbers without a lead are left out.
+        """
+        crm_instance = self.get_active_crm_instance()
+        if not crm_instance:
+            logger.warning(f"[CRMRouter] No active CRM to search leads for tenant {self.tenant_id}.")
+            return {}
+
+        phone_numbers = [phone for phone in phone_numbers if sum(map(str.isdecimal, phone or "")) >= _MIN_PHONE_DIGITS]
+        logger.info(f"[CRMRouter] Routing search for {len(phone_numbers)} leads to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
+        if hasattr(crm_instance, 'search_leads_by_phones'):
+            leads_by_phone = crm_instance.search_leads_by_phones(phone_numbers)
+        else:
+            leads_by_phone = {phone: crm_instance.search_lead(phone) for phone in dict.fromkeys(phone_numbers)}
+        return {phone: self._with_display_name(lead) for phone, lead in leads_by_phone.items() if lead}
+
+    async def async_create_lead(self, normalized_lead_data: dict) -> dict | None:
+        """
+        Async variant of create_lead. CRMs without an async client run their sync call in a worker thread.
         """
         crm_instance = self.get_active_crm_instance()
         if crm_instance:
+            logger.info(f"[CRMRouter] Routing lead creation to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
+            if hasattr(crm_instance, 'async_create_lead'):
+                created_lead = await crm_instance.async_create_lead(normalized_lead_data)
+            else:
+                created_lead = await asyncio.to_thread(crm_instance.create_lead, normalized_lead_data)
+            if created_lead:
+                self._forget_search(normalized_lead_data.get('phone'))
+            return created_lead
+        logger.warning(f"[CRMRouter] No active CRM to create lead for tenant {self.tenant_id}.")
+        return None
+
+    async def async_search_lead(self, phone_number: str) -> dict | None:
+        """
+        Async variant of search_lead. CRMs without an async client run their sync call in a worker thread.
+        """
+        crm_instance = self.get_active_crm_instance()
+        if crm_instance:
+            cache_key = self._search_cache_key(phone_number)
+            found, lead_record = self._cached_search(cache_key)
+            if found:
+                return lead_record
             logger.info(f"[CRMRouter] Routing lead search to {self.active_crm_name} CRM for tenant {self.tenant_id}.")
-            return crm_instance.search_lead(phone_number)
+            if hasattr(crm_instance, 'async_search_lead'):
+                lead_record = await crm_instance.async_search_lead(phone_number)
+            else:
+                lead_record = await asyncio.to_thread(crm_instance.search_lead, phone_number)
+            return self._cache_search(cache_key, self._with_display_name(lead_record))
         logger.warning(f"[CRMRouter] No active CRM to search lead for tenant {self.tenant_id}.")
         return None
 
+    def _search_cache_key(self, phone_number: str | None) -> tuple[str, str]:
+        """
+        Builds the lead search cache key. Only the digits count, as searches use the raw chat user id while
+        created leads carry the normalized phone number.
+        """
+        return self.tenant_id, "".join(filter(str.isdecimal, phone_number or ""))
+
+    @staticmethod
+    def _cached_search(cache_key: tuple[str, str]) -> tuple[bool, dict | None]:
+        """Returns (True, lead record or None) for a search answered without the CRM, otherwise (False, None)."""
+        if len(cache_key[1]) < _MIN_PHONE_DIGITS:
+            return True, None # Too few digits to be a phone number, so no CRM has a lead for it
+        lead_record = _LEAD_SEARCH_CACHE.get(cache_key)
+        if lead_record is not None:
+            return True, dict(lead_record) # A copy, so callers can't change the cached record
+        return _LEAD_MISS_CACHE.get(cache_key, False), None
+
+    @staticmethod
+    def _cache_search(cache_key: tuple[str, str], lead_record: dict | None) -> dict | None:
+        """Caches a search result (a found lead, or a miss) and returns it."""
+        if lead_record:
+            _LEAD_SEARCH_CACHE.set(cache_key, dict(lead_record))
+        else:
+            _LEAD_MISS_CACHE.set(cache_key, True)
+        return lead_record
+
+    def _forget_search(self, phone_number: str | None) -> None:
+        """Drops the cached search for a phone number a lead was just created for, so the new lead is found."""
+        cache_key = self._search_cache_key(phone_number)
+        _LEAD_SEARCH_CACHE.pop(cache_key)
+        _LEAD_MISS_CACHE.pop(cache_key)
+
+    @staticmethod
+    def _with_display_name(lead_record: dict | None) -> dict | None:
+        """Adds the 'display_name' key to a found lead record, whichever CRM it came from."""
+        if lead_record:
+            # HubSpot uses 'firstname', 'lastname'; Zoho uses 'First_Name', 'Last_Name', 'Full_Name'
+            lead_record['display_name'] = lead_record.get('Full_Name') or \
+                                          lead_record.get('firstname') or \
+                                          lead_record.get('First_Name') or \
+                                          "valued customer" # Fallback
+        return lead_record
+
@@ -0,0 +1,84 @@
+import asyncio
+import random
+import weakref
+
+import aiohttp
+import httpx
+
+from utils.http_session import RETRY_STATUSES
+
+# One aiohttp session per event loop, shared by every tenant's async Zoho calls, so calls
+# reuse pooled keep-alive connections instead of new TLS handshakes. A session can only be used on the loop
+# it was created on, hence one per loop.
+_CRM_SESSIONS = weakref.WeakKeyDictionary() # {event loop: aiohttp.ClientSession}
+# HubSpot's API speaks HTTP/2, so its async calls use an HTTP/2 httpx client instead: concurrent requests are
+# multiplexed over a few connections rather than each taking one from the pool. Also one per event loop.
+_HUBSPOT_CLIENTS = weakref.WeakKeyDictionary() # {event loop: httpx.AsyncClient}
+
+# Attempts per async CRM call for transient failures, with exponential back-off between them
+_RETRY_ATTEMPTS = 4
+_RETRY_INITIAL_DELAY = 0.3
+_RETRY_MAX_DELAY = 5.0
+
+def get_crm_session() -> aiohttp.ClientSession:
+    """Returns the CRM aiohttp session for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    session = _CRM_SESSIONS.get(loop)
+    if session is None or session.closed:
+        session = _CRM_SESSIONS[loop] = aiohttp.ClientSession(
+            # DNS answers are cached for 5 minutes (aiohttp's default is 10 s), so resolving each Zoho data centre
+            # host is shared by every tenant's calls rather than repeated every few seconds under load
+            connector=aiohttp.TCPConnector(limit=200, limit_per_host=30, keepalive_timeout=60,
+                                           use_dns_cache=True, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=10),
+        )
+    return session
+
+def get_hubspot_client() -> httpx.AsyncClient:
+    """Returns the HTTP/2 HubSpot client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _HUBSPOT_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = _HUBSPOT_CLIENTS[loop] = httpx.AsyncClient(
+            http2=True,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+    return client
+
+async def close() -> None:
+    """Closes the running event loop's CRM session and HubSpot client, if any. Call it on shutdown, from that loop."""
+    loop = asyncio.get_running_loop()
+    session = _CRM_SESSIONS.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+    client = _HUBSPOT_CLIENTS.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+async def send_with_retries(send, retry_statuses=RETRY_STATUSES, retry_exceptions=()) -> tuple[int, bytes]:
+    """
+    Awaits send() for a (status, body) response, retrying transient failures instead of failing the whole call.
+    Between attempts it waits a random time up to 0.3 s, doubling each attempt up to 5 s (full jitter), so clients
+    that failed together don't retry together.
+    Args:
+        send (callable): Coroutine function that makes the request and returns (status code, body bytes).
+        retry_statuses (iterable[int]): Statuses worth another attempt. Others, e.g. 401/403, are returned at once.
+            Pass only (429,) for calls that aren't safe to repeat once the server has processed them.
+        retry_exceptions (tuple[type[Exception], ...]): Transport errors worth another attempt.
+    Returns:
+        tuple[int, bytes]: The last response's status code and body.
+    Raises:
+        The last attempt's exception, or any exception not in retry_exceptions.
+    """
+    for attempt in range(_RETRY_ATTEMPTS):
+        last_attempt = attempt == _RETRY_ATTEMPTS - 1
+        try:
+            status, body = await send()
+        except retry_exceptions:
+            if last_attempt:
+                raise
+        else:
+            if last_attempt or status not in retry_statuses:
+                return status, body
+        await asyncio.sleep(random.uniform(0, min(_RETRY_MAX_DELAY, _RETRY_INITIAL_DELAY * 2 ** attempt)))
@@ -1,18 +1,65 @@
 import os
+import httpx
 import requests
-import json
+import orjson
 import logging
+import weakref
+
+from integrations.http_client import get_hubspot_client, send_with_retries
+from utils.http_session import REQUEST_TIMEOUT, create_http_adapter, create_http_session
 
 logger = logging.getLogger(__name__)
 
+# HubSpot's search and batch endpoints take at most 100 values / records per request
+_BATCH_LIMIT = 100
+_CONTACT_PROPERTIES = ["firstname", "lastname", "email", "phone"] # Properties returned by searches
+# (normalized lead field, HubSpot contact property) pairs sent when creating a contact; add new properties here
+_CONTACT_PROPERTY_MAP = (("first_name", "firstname"), ("last_name", "lastname"), ("email", "email"), ("phone", "phone"))
+_SEARCH_URL = "https://api.hubapi.com/crm/v3/objects/contacts/search"
+# JSON body of a single-contact search by phone, serialized once and split where the phone number goes.
+# The placeholder is NUL-delimited, so no real property, operator or value contains it.
+_SEARCH_PHONE_PLACEHOLDER = "\x00PHONE\x00"
+_SEARCH_BODY_TEMPLATE = orjson.dumps({
+    "filterGroups": [{"filters": [{"propertyName": "phone", "operator": "EQ", "value": _SEARCH_PHONE_PLACEHOLDER}]}],
+    "properties": _CONTACT_PROPERTIES, # Properties to return
+    "limit": 1 # We only need one match
+})
+if _SEARCH_BODY_TEMPLATE.count(orjson.dumps(_SEARCH_PHONE_PLACEHOLDER)) != 1:
+    raise RuntimeError("The phone placeholder must appear exactly once in the HubSpot search body.")
+_SEARCH_BODY_PREFIX, _SEARCH_BODY_SUFFIX = _SEARCH_BODY_TEMPLATE.split(orjson.dumps(_SEARCH_PHONE_PLACEHOLDER))
+
+# Default keep-alive session for HubSpot calls, so each call after the first reuses a warm TLS connection
+_HUBSPOT_HTTP_SESSION = create_http_session(pool_connections=4, pool_maxsize=16)
+
+# Sessions _retry_searches has mounted its adapter on; weak, so a caller's session is still freed once unused
+_SEARCH_RETRY_SESSIONS = weakref.WeakSet()
+
+def _retry_searches(http_session: requests.Session) -> None:
+    """
+    Mounts a retry policy for contact searches on the session, once per session. Searches are POSTs, which the
+    session's own policy doesn't retry, but they only read, so 429s and 5xx are safe to retry.
+    """
+    if http_session in _SEARCH_RETRY_SESSIONS:
+        return
+    http_session.mount(_SEARCH_URL, create_http_adapter(pool_connections=1, pool_maxsize=16, retry_methods={"POST"}))
+    _SEARCH_RETRY_SESSIONS.add(http_session)
+
 class HubSpotCRM:
-    def __init__(self, api_key: str, tenant_id: str):
+    def __init__(self, api_key: str, tenant_id: str, http_session: requests.Session = None):
         self.hubspot_api_key = api_key
         self.tenant_id = tenant_id
         if not self.hubspot_api_key:
             raise ValueError("HubSpot API Key is not provided for HubSpotCRM initialization.")
 
         self.hubspot_api_url = "https://api.hubapi.com/crm/v3/objects/contacts"
+        # Keep-alive session for the sync API calls; callers can pass a shared one. Sessions may be shared by
+        # tenants, so the tenant's API key goes in each request's headers (built once here), not the session's.
+        self.http_session = http_session or _HUBSPOT_HTTP_SESSION
+        _retry_searches(self.http_session)
+        self._request_headers = {
+            "Authorization": f"Bearer {self.hubspot_api_key}",
+            "Content-Type": "application/json"
+        }
         logger.info(f"[HubSpotCRM] Initialized for tenant: {tenant_id}.")
 
     def search_lead(self, phone_number: str) -> dict | None:
@@ -23,48 +70,19 @@ class HubSpotCRM:
         Returns:
             dict | None: The contact record if found, otherwise None.
         """
-        search_url = f"{self.hubspot_api_url}/search"
-        headers = {
-            "Authorization": f"Bearer {self.hubspot_api_key}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
-            "filterGroups": [
-                {
-                    "filters": [
-                        {
-                            "propertyName": "phone",
-                            "operator": "EQ",
-                            "value": phone_number
-                        }
-                    ]
-                }
-            ],
-            "properties": ["firstname", "lastname", "email", "phone"], # Properties to return
-            "limit": 1 # We only need one match
-        }
-
         try:
             logger.info(f"[HubSpotCRM] Searching for contact with phone: {phone_number} for tenant {self.tenant_id}.")
-            response = requests.post(search_url, headers=headers, json=payload)
+            search_url, headers, body = self._search_request(phone_number)
+            response = self.http_session.post(search_url, headers=headers, data=body, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
-
-            if data.get('results') and len(data['results']) > 0:
-                contact = data['results'][0]
-                logger.info(f"[HubSpotCRM] Contact found for tenant {self.tenant_id}: {contact['properties'].get('firstname', '')} {contact['properties'].get('lastname', '')}")
-                return contact['properties'] # Return the properties dictionary
-            else:
-                logger.info(f"[HubSpotCRM] No contact found for phone: {phone_number} for tenant {self.tenant_id}.")
-                return None
+            return self._search_result(orjson.loads(response.content), phone_number)
 
         except requests.exceptions.RequestException as e:
             logger.error(f"[HubSpotCRM ERROR] HTTP error during contact search for tenant {self.tenant_id}: {e}")
-            if response and response.text:
-                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response.text}")
+            if e.response is not None and e.response.text:
+                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {e.response.text}")
             return None
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact search for tenant {self.tenant_id}: {response.text}")
             return None
         except Exception as e:
@@ -79,52 +97,214 @@ class HubSpotCRM:
         Returns:
             dict | None: The created contact record details if successful, otherwise None.
         """
-        create_url = self.hubspot_api_url
-        headers = {
-            "Authorization": f"Bearer {self.hubspot_api_key}",
-            "Content-Type": "application/json"
-        }
+        try:
+            create_url, headers, body = self._create_request(lead_data)
+            response = self.http_session.post(create_url, headers=headers, data=body, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return self._create_result(orjson.loads(response.content), response.text)
 
-        properties = {
-            "firstname": lead_data.get('first_name', ''),
-            "lastname": lead_data.get('last_name', ''),
-            "email": lead_data.get('email', ''),
-            "phone": lead_data.get('phone', '')
-            # You can add other properties here, e.g., "lead_source": "WhatsApp Bot"
-        }
+        except requests.exceptions.RequestException as e:
+            logger.error(f"[HubSpotCRM ERROR] HTTP error during contact creation for tenant {self.tenant_id}: {e}")
+            if e.response is not None and e.response.text:
+                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {e.response.text}")
+            return None
+        except orjson.JSONDecodeError:
+            logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact creation for tenant {self.tenant_id}: {response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"[HubSpotCRM ERROR] An unexpected error occurred during contact creation for tenant {self.tenant_id}: {e}")
+            return None
 
-        # Filter out empty properties to avoid issues with HubSpot API if a field is not required
-        properties = {k: v for k, v in properties.items() if v}
+    async def async_search_lead(self, phone_number: str) -> dict | None:
+        """
+        Async variant of search_lead: the API call runs on the shared HTTP/2 client, so the event loop serves
+        other users while HubSpot answers, and concurrent calls share one connection.
+        """
+        try:
+            logger.info(f"[HubSpotCRM] Searching for contact with phone: {phone_number} for tenant {self.tenant_id}.")
+            search_url, headers, body = self._search_request(phone_number)
 
-        payload = {
-            "properties": properties
-        }
+            async def send():
+                response = await get_hubspot_client().post(search_url, headers=headers, content=body)
+                return response.status_code, response.content
+            # A search only reads, so transport errors, 429s and 5xx are all safe to retry
+            status, response_body = await send_with_retries(send, retry_exceptions=(httpx.TransportError,))
+            if status >= 400:
+                logger.error(f"[HubSpotCRM ERROR] HTTP error {status} during contact search for tenant {self.tenant_id}.")
+                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response_body.decode(errors='replace')}")
+                return None
+            return self._search_result(orjson.loads(response_body), phone_number)
 
+        except httpx.HTTPError as e:
+            logger.error(f"[HubSpotCRM ERROR] HTTP error during contact search for tenant {self.tenant_id}: {e!r}")
+            return None
+        except orjson.JSONDecodeError:
+            logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact search for tenant {self.tenant_id}: {response_body.decode(errors='replace')}")
+            return None
+        except Exception as e:
+            logger.error(f"[HubSpotCRM ERROR] An unexpected error occurred during contact search for tenant {self.tenant_id}: {e}")
+            return None
+
+    async def async_create_lead(self, lead_data: dict) -> dict | None:
+        """
+        Async variant of create_lead, on the shared HTTP/2 client like async_search_lead.
+        """
         try:
-            logger.info(f"[HubSpotCRM] Creating new contact: {properties.get('firstname', '')} {properties.get('lastname', '')} ({properties.get('phone', '')}) for tenant {self.tenant_id}.")
-            response = requests.post(create_url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('id'): # HubSpot returns the created contact object directly
-                created_contact_id = data['id']
-                logger.info(f"[HubSpotCRM] Contact created successfully with ID: {created_contact_id} for tenant {self.tenant_id}.")
-                return data['properties'] # Return the properties of the created contact
-            else:
-                logger.error(f"[HubSpotCRM ERROR] Failed to create contact for tenant {self.tenant_id}: {data.get('message', 'Unknown error')}")
-                if response and response.text:
-                    logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response.text}")
+            create_url, headers, body = self._create_request(lead_data)
+
+            async def send():
+                response = await get_hubspot_client().post(create_url, headers=headers, content=body)
+                return response.status_code, response.content
+            # Only a rate-limited (429) create is certain not to have been processed; retrying anything else
+            # could create the contact twice
+            status, response_body = await send_with_retries(send, retry_statuses=(429,))
+            if status >= 400:
+                logger.error(f"[HubSpotCRM ERROR] HTTP error {status} during contact creation for tenant {self.tenant_id}.")
+                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response_body.decode(errors='replace')}")
                 return None
+            return self._create_result(orjson.loads(response_body), response_body.decode(errors='replace'))
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[HubSpotCRM ERROR] HTTP error during contact creation for tenant {self.tenant_id}: {e}")
-            if response and response.text:
-                logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response.text}")
+        except httpx.HTTPError as e:
+            logger.error(f"[HubSpotCRM ERROR] HTTP error during contact creation for tenant {self.tenant_id}: {e!r}")
             return None
-        except json.JSONDecodeError:
-            logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact creation for tenant {self.tenant_id}: {response.text}")
+        except orjson.JSONDecodeError:
+            logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact creation for tenant {self.tenant_id}: {response_body.decode(errors='replace')}")
             return None
         except Exception as e:
             logger.error(f"[HubSpotCRM ERROR] An unexpected error occurred during contact creation for tenant {self.tenant_id}: {e}")
             return None
 
+    def search_leads_by_phones(self, phone_numbers: list[str]) -> dict[str, dict]:
+        """
+        Searches for the contacts of many phone numbers, with one IN-filter search per 100 numbers instead of
+        one search per number.
+        Args:
+            phone_numbers (list[str]): The phone numbers to search for.
+        Returns:
+            dict[str, dict]: The properties of the first contact found for each phone number; numbers without
+            a contact are left out.
+        """
+        phone_numbers = list(dict.fromkeys(phone_numbers)) # Drop duplicates, keeping the order
+        contacts_by_phone = {}
+        for start in range(0, len(phone_numbers), _BATCH_LIMIT):
+            batch = phone_numbers[start:start + _BATCH_LIMIT]
+            payload = {
+                "filterGroups": [{"filters": [{"propertyName": "phone", "operator": "IN", "values": batch}]}],
+                "properties": _CONTACT_PROPERTIES,
+                "limit": _BATCH_LIMIT
+            }
+            try:
+                logger.info(f"[HubSpotCRM] Searching for contacts of {len(batch)} phone numbers for tenant {self.tenant_id}.")
+                while True: # Several contacts may share a number, so there can be more than one page
+                    response = self.http_session.post(f"{self.hubspot_api_url}/search", headers=self._request_headers,
+                                                      data=orjson.dumps(payload), timeout=REQUEST_TIMEOUT)
+                    response.raise_for_status()
+                    data = orjson.loads(response.content)
+                    for contact in data.get('results', []):
+                        if contact['properties'].get('phone') in batch:
+                            contacts_by_phone.setdefault(contact['properties']['phone'], contact['properties'])
+                    next_page = data.get('paging', {}).get('next', {}).get('after')
+                    if not next_page:
+                        break
+                    payload["after"] = next_page
+
+            except requests.exceptions.RequestException as e:
+                logger.error(f"[HubSpotCRM ERROR] HTTP error during contact search for tenant {self.tenant_id}: {e}")
+                if e.response is not None and e.response.text:
+                    logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {e.response.text}")
+            except orjson.JSONDecodeError:
+                logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact search for tenant {self.tenant_id}: {response.text}")
+
+        logger.info(f"[HubSpotCRM] Found contacts for {len(contacts_by_phone)} of {len(phone_numbers)} phone numbers for tenant {self.tenant_id}.")
+        return contacts_by_phone
+
+    def create_leads(self, lead_data_list: list[dict]) -> list[dict | None]:
+        """
+        Creates many contacts with one batch create request per 100 contacts instead of one request per contact.
+        Args:
+            lead_data_list (list[dict]): Normalized lead data dictionaries, as for create_lead.
+        Returns:
+            list[dict | None]: For each input, in order, the created contact's properties, or None if it wasn't created.
+        """
+        results = []
+        for start in range(0, len(lead_data_list), _BATCH_LIMIT):
+            batch_properties = [self._contact_properties(lead_data) for lead_data in lead_data_list[start:start + _BATCH_LIMIT]]
+            batch_results = [None] * len(batch_properties)
+            try:
+                logger.info(f"[HubSpotCRM] Creating {len(batch_properties)} contacts for tenant {self.tenant_id}.")
+                response = self.http_session.post(f"{self.hubspot_api_url}/batch/create", headers=self._request_headers,
+                                                  data=orjson.dumps({"inputs": [{"properties": p} for p in batch_properties]}),
+                                                  timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                data = orjson.loads(response.content)
+                # Batch results don't come back in input order, so match each created contact to its input by
+                # email (unique per HubSpot contact), or by phone for inputs without one
+                unmatched = {}
+                for index, properties in enumerate(batch_properties):
+                    unmatched.setdefault(properties.get('email') or properties.get('phone'), []).append(index)
+                for contact in data.get('results', []):
+                    indexes = unmatched.get(contact['properties'].get('email') or contact['properties'].get('phone'))
+                    if indexes:
+                        batch_results[indexes.pop(0)] = contact['properties']
+                for error in data.get('errors', []):
+                    logger.error(f"[HubSpotCRM ERROR] Failed to create a contact for tenant {self.tenant_id}: {error.get('message', 'Unknown error')}")
+
+            except requests.exceptions.RequestException as e:
+                logger.error(f"[HubSpotCRM ERROR] HTTP error during contact creation for tenant {self.tenant_id}: {e}")
+                if e.response is not None and e.response.text:
+                    logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {e.response.text}")
+            except orjson.JSONDecodeError:
+                logger.error(f"[HubSpotCRM ERROR] Invalid JSON response during contact creation for tenant {self.tenant_id}: {response.text}")
+            results.extend(batch_results)
+
+        logger.info(f"[HubSpotCRM] Created {sum(result is not None for result in results)} of {len(lead_data_list)} contacts for tenant {self.tenant_id}.")
+        return results
+
+    def _search_request(self, phone_number: str) -> tuple:
+        """Returns the (url, headers, JSON body) of a contact search."""
+        # Only the phone number varies, so it is serialized on its own between the prebuilt halves of the body
+        body = _SEARCH_BODY_PREFIX + orjson.dumps(phone_number) + _SEARCH_BODY_SUFFIX
+        return _SEARCH_URL, self._request_headers, body
+
+    def _search_result(self, data: dict, phone_number: str) -> dict | None:
+        """Returns the properties of the first contact in a contact search response, or None if there is none."""
+        if data.get('results') and len(data['results']) > 0:
+            contact = data['results'][0]
+            logger.info(f"[HubSpotCRM] Contact found for tenant {self.tenant_id}: {contact['properties'].get('firstname', '')} {contact['properties'].get('lastname', '')}")
+            return contact['properties'] # Return the properties dictionary
+        logger.info(f"[HubSpotCRM] No contact found for phone: {phone_number} for tenant {self.tenant_id}.")
+        return None
+
+    def _create_request(self, lead_data: dict) -> tuple:
+        """
+        Builds the HubSpot contact from normalized lead_data and returns the (url, headers, JSON body) that create it.
+        """
+        properties = self._contact_properties(lead_data)
+        payload = {
+            "properties": properties
+        }
+
+        logger.info(f"[HubSpotCRM] Creating new contact: {properties.get('firstname', '')} {properties.get('lastname', '')} ({properties.get('phone', '')}) for tenant {self.tenant_id}.")
+        return self.hubspot_api_url, self._request_headers, orjson.dumps(payload)
+
+    @staticmethod
+    def _contact_properties(lead_data: dict) -> dict:
+        """Returns the HubSpot contact properties for a normalized lead_data dictionary."""
+        # Empty fields are left out, to avoid issues with HubSpot API if a field is not required
+        properties = {}
+        for lead_field, contact_property in _CONTACT_PROPERTY_MAP:
+            value = lead_data.get(lead_field)
+            if value:
+                properties[contact_property] = value
+        return properties
+
+    def _create_result(self, data: dict, response_text: str) -> dict | None:
+        """Returns the created contact's properties from a contact creation response, or None if it wasn't created."""
+        if data.get('id'): # HubSpot returns the created contact object directly
+            created_contact_id = data['id']
+            logger.info(f"[HubSpotCRM] Contact created successfully with ID: {created_contact_id} for tenant {self.tenant_id}.")
+            return data['properties'] # Return the properties of the created contact
+        logger.error(f"[HubSpotCRM ERROR] Failed to create contact for tenant {self.tenant_id}: {data.get('message', 'Unknown error')}")
+        if response_text:
+            logger.error(f"[HubSpotCRM ERROR] HubSpot API Response: {response_text}")
+        return None
@@ -1,16 +1,37 @@
+import asyncio
+import aiohttp
 import requests
-import json
+import orjson
 import os
+import re
+import logging
 # Removed: from dotenv import load_dotenv # Load dotenv only in main entry point
 from console_chatbot.zoho_auth_manager import ZohoAuthManager # Import the new ZohoAuthManager class
+from integrations.http_client import get_crm_session, send_with_retries
+from utils.http_session import REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Zoho's search API accepts at most 10 conditions in one criteria expression
+_SEARCH_CRITERIA_LIMIT = 10
+# ...and at most 100 records in one insert request
+_INSERT_RECORDS_LIMIT = 100
+# Characters with a meaning in criteria expressions, which must be backslash-escaped inside a value
+_CRITERIA_SPECIAL_CHARS_RE = re.compile(r"([(),\\])")
+
+def _escape_criteria_value(value: str) -> str:
+    """Escapes a value for use in a Zoho search criteria expression."""
+    return _CRITERIA_SPECIAL_CHARS_RE.sub(r"\\\1", value)
 
 class ZohoCRM:
-    def __init__(self, auth_manager: ZohoAuthManager, api_url: str):
+    def __init__(self, auth_manager: ZohoAuthManager, api_url: str, http_session: requests.Session = None):
         self.auth_manager = auth_manager
         self.api_url = api_url
+        # Keep-alive session for the CRM API calls; by default the one the auth manager uses
+        self.http_session = http_session or auth_manager.http_session
         if not self.api_url:
             raise ValueError("ZOHO_API_URL is not set for ZohoCRM initialization.")
-        print(f"[ZohoCRM] Initialized for tenant: {auth_manager.tenant_id}.")
+        logger.info("[ZohoCRM] Initialized for tenant: %s.", auth_manager.tenant_id)
 
     def search_lead(self, phone_number: str) -> dict | None:
         """
@@ -22,40 +43,26 @@ class ZohoCRM:
         """
         access_token = self.auth_manager.get_access_token()
         if not access_token:
-            print(f"[ZohoCRM ERROR] Could not get access token for searching leads for tenant {self.auth_manager.tenant_id}.")
+            logger.error("[ZohoCRM ERROR] Could not get access token for searching leads for tenant %s.", self.auth_manager.tenant_id)
             return None
 
-        search_url = f"{self.api_url}/crm/v2/Leads/search"
-        headers = {
-            "Authorization": f"Zoho-oauthtoken {access_token}"
-        }
-        params = {
-            "phone": phone_number # Assuming 'Phone' is the field for search
-        }
-
         try:
-            print(f"[ZohoCRM] Searching for lead with phone: {phone_number} for tenant {self.auth_manager.tenant_id}.")
-            response = requests.get(search_url, headers=headers, params=params)
+            logger.info("[ZohoCRM] Searching for lead with phone: %s for tenant %s.", phone_number, self.auth_manager.tenant_id)
+            url, headers, params = self._search_request(access_token, phone_number)
+            response = self.http_session.get(url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            data = response.json()
-
-            if data.get('data') and len(data['data']) > 0:
-                print(f"[ZohoCRM] Lead found for tenant {self.auth_manager.tenant_id}: {data['data'][0].get('Full_Name', 'Unknown')}")
-                return data['data'][0] # Return the first lead found
-            else:
-                print(f"[ZohoCRM] No lead found for phone: {phone_number} for tenant {self.auth_manager.tenant_id}.")
-                return None
+            return self._search_result(orjson.loads(response.content), phone_number)
 
         except requests.exceptions.RequestException as e:
-            print(f"[ZohoCRM ERROR] HTTP error during lead search for tenant {self.auth_manager.tenant_id}: {e}")
-            if response and response.text:
-                print(f"[ZohoCRM ERROR] Zoho API Response: {response.text}")
+            logger.error("[ZohoCRM ERROR] HTTP error during lead search for tenant %s: %s", self.auth_manager.tenant_id, e)
+            if e.response is not None and e.response.text:
+                logger.error("[ZohoCRM ERROR] Zoho API Response: %s", e.response.text)
             return None
-        except json.JSONDecodeError:
-            print(f"[ZohoCRM ERROR] Invalid JSON response during lead search for tenant {self.auth_manager.tenant_id}: {response.text}")
+        except orjson.JSONDecodeError:
+            logger.error("[ZohoCRM ERROR] Invalid JSON response during lead search for tenant %s: %s", self.auth_manager.tenant_id, response.text)
             return None
         except Exception as e:
-            print(f"[ZohoCRM ERROR] An unexpected error occurred during lead search for tenant {self.auth_manager.tenant_id}: {e}")
+            logger.error("[ZohoCRM ERROR] An unexpected error occurred during lead search for tenant %s: %s", self.auth_manager.tenant_id, e)
             return None
 
     def create_lead(self, lead_data: dict) -> dict | None:
@@ -68,9 +75,159 @@ class ZohoCRM:
         """
         access_token = self.auth_manager.get_access_token()
         if not access_token:
-            print(f"[ZohoCRM ERROR] Could not get access token for creating lead for tenant {self.auth_manager.tenant_id}.")
+            logger.error("[ZohoCRM ERROR] Could not get access token for creating lead for tenant %s.", self.auth_manager.tenant_id)
             return None
 
+        try:
+            url, headers, body = self._create_request(access_token, lead_data)
+            response = self.http_session.post(url, headers=headers, data=body, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return self._create_result(orjson.loads(response.content), response.text)
+
+        except requests.exceptions.RequestException as e:
+            logger.error("[ZohoCRM ERROR] HTTP error during lead creation for tenant %s: %s", self.auth_manager.tenant_id, e)
+            if e.response is not None and e.response.text:
+                logger.error("[ZohoCRM ERROR] Zoho API Response: %s", e.response.text)
+            return None
+        except orjson.JSONDecodeError:
+            logger.error("[ZohoCRM ERROR] Invalid JSON response during lead creation for tenant %s: %s", self.auth_manager.tenant_id, response.text)
+            return None
+        except Exception as e:
+            logger.error("[ZohoCRM ERROR] An unexpected error occurred during lead creation for tenant %s: %s", self.auth_manager.tenant_id, e)
+            return None
+
+    def search_leads_by_phones(self, phone_numbers: list[str]) -> dict[str, dict]:
+        """
+        Searches for the leads of many phone numbers, with one request per 10 numbers instead of one per number.
+        Unlike search_lead, which matches any phone field, this matches the lead's Phone field exactly.
+        Args:
+            phone_numbers (list[str]): The phone numbers to search for.
+        Returns:
+            dict[str, dict]: The first lead found for each phone number; numbers without a lead are left out.
+        """
+        access_token = self.auth_manager.get_access_token()
+        if not access_token:
+            logger.error("[ZohoCRM ERROR] Could not get access token for searching leads for tenant %s.", self.auth_manager.tenant_id)
+            return {}
+
+        search_url = f"{self.api_url}/crm/v2/Leads/search"
+        headers = {
+            "Authorization": f"Zoho-oauthtoken {access_token}"
+        }
+        phone_numbers = list(dict.fromkeys(phone_numbers)) # Drop duplicates, keeping the order
+        leads_by_phone = {}
+        for start in range(0, len(phone_numbers), _SEARCH_CRITERIA_LIMIT):
+            batch = phone_numbers[start:start + _SEARCH_CRITERIA_LIMIT]
+            criteria = "or".join(f"(Phone:equals:{_escape_criteria_value(phone)})" for phone in batch)
+            try:
+                logger.info("[ZohoCRM] Searching for leads of %s phone numbers for tenant %s.", len(batch), self.auth_manager.tenant_id)
+                response = self.http_session.get(search_url, headers=headers, params={"criteria": f"({criteria})"}, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                if response.status_code == 204: # No lead matched any number in the batch
+                    continue
+                for lead in orjson.loads(response.content).get('data', []):
+                    if lead.get('Phone') in batch:
+                        leads_by_phone.setdefault(lead['Phone'], lead)
+
+            except requests.exceptions.RequestException as e:
+                logger.error("[ZohoCRM ERROR] HTTP error during lead search for tenant %s: %s", self.auth_manager.tenant_id, e)
+                if e.response is not None and e.response.text:
+                    logger.error("[ZohoCRM ERROR] Zoho API Response: %s", e.response.text)
+            except orjson.JSONDecodeError:
+                logger.error("[ZohoCRM ERROR] Invalid JSON response during lead search for tenant %s: %s", self.auth_manager.tenant_id, response.text)
+
+        logger.info("[ZohoCRM] Found leads for %s of %s phone numbers for tenant %s.", len(leads_by_phone), len(phone_numbers), self.auth_manager.tenant_id)
+        return leads_by_phone
+
+    def create_leads(self, lead_data_list: list[dict]) -> list[dict | None]:
+        """
+        Creates many leads with one request per 100 leads (Zoho's limit per insert) instead of one per lead.
+        Args:
+            lead_data_list (list[dict]): Normalized lead data dictionaries, as for create_lead.
+        Returns:
+            list[dict | None]: For each input, in order, the created lead's details, or None if it wasn't created.
+        """
+        access_token = self.auth_manager.get_access_token()
+        if not access_token:
+            logger.error("[ZohoCRM ERROR] Could not get access token for creating leads for tenant %s.", self.auth_manager.tenant_id)
+            return [None] * len(lead_data_list)
+
+        create_url = self._create_url()
+        headers = self._create_headers(access_token)
+        results = []
+        for start in range(0, len(lead_data_list), _INSERT_RECORDS_LIMIT):
+            batch = lead_data_list[start:start + _INSERT_RECORDS_LIMIT]
+            payload = {
+                "data": [self._lead_record(lead_data) for lead_data in batch],
+                "trigger": ["approval", "workflow", "blueprint"]
+            }
+            batch_results = [None] * len(batch)
+            try:
+                logger.info("[ZohoCRM] Creating %s leads for tenant %s.", len(batch), self.auth_manager.tenant_id)
+                response = self.http_session.post(create_url, headers=headers, data=orjson.dumps(payload), timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                # Zoho reports each record's outcome at the same index as the record in the request
+                for index, outcome in enumerate(orjson.loads(response.content).get('data', [])[:len(batch)]):
+                    if outcome.get('status') == 'success':
+                        batch_results[index] = outcome['details']
+                    else:
+                        logger.error("[ZohoCRM ERROR] Failed to create lead %s for tenant %s: %s", start + index, self.auth_manager.tenant_id, outcome.get('message', 'Unknown error'))
+
+            except requests.exceptions.RequestException as e:
+                logger.error("[ZohoCRM ERROR] HTTP error during lead creation for tenant %s: %s", self.auth_manager.tenant_id, e)
+                if e.response is not None and e.response.text:
+                    logger.error("[ZohoCRM ERROR] Zoho API Response: %s", e.response.text)
+            except orjson.JSONDecodeError:
+                logger.error("[ZohoCRM ERROR] Invalid JSON response during lead creation for tenant %s: %s", self.auth_manager.tenant_id, response.text)
+            results.extend(batch_results)
+
+        logger.info("[ZohoCRM] Created %s of %s leads for tenant %s.", sum(result is not None for result in results), len(lead_data_list), self.auth_manager.tenant_id)
+        return results
+
+    def _search_request(self, access_token: str, phone_number: str) -> tuple:
+        """Returns the (url, headers, query parameters) of a lead search."""
+        search_url = f"{self.api_url}/crm/v2/Leads/search"
+        headers = {
+            "Authorization": f"Zoho-oauthtoken {access_token}"
+        }
+        params = {
+            "phone": phone_number # Assuming 'Phone' is the field for search
+        }
+        return search_url, headers, params
+
+    def _search_result(self, data: dict, phone_number: str) -> dict | None:
+        """Returns the first lead in a lead search response, or None if there is none."""
+        if data.get('data') and len(data['data']) > 0:
+            logger.info("[ZohoCRM] Lead found for tenant %s: %s", self.auth_manager.tenant_id, data['data'][0].get('Full_Name', 'Unknown'))
+            return data['data'][0] # Return the first lead found
+        logger.info("[ZohoCRM] No lead found for phone: %s for tenant %s.", phone_number, self.auth_manager.tenant_id)
+        return None
+
+    def _create_request(self, access_token: str, lead_data: dict) -> tuple:
+        """
+        Builds the Zoho lead from normalized lead_data and returns the (url, headers, JSON body) that create it.
+        """
+        lead = self._lead_record(lead_data)
+
+        logger.info("[ZohoCRM] Creating new lead: %s %s (%s) for tenant %s.", lead['First_Name'], lead['Last_Name'], lead['Phone'], self.auth_manager.tenant_id)
+        # {"data": [lead]}, with the envelope written as bytes around the serialized lead
+        return self._create_url(), self._create_headers(access_token), b'{"data":[' + orjson.dumps(lead) + b']}'
+
+    def _create_url(self) -> str:
+        """Returns the URL that creates leads."""
+        return f"{self.api_url}/crm/v2/Leads"
+
+    @staticmethod
+    def _create_headers(access_token: str) -> dict:
+        """Returns the headers of a lead creation request."""
+        return {
+            "Authorization": f"Zoho-oauthtoken {access_token}",
+            "Content-Type": "application/json"
+        }
+
+    @staticmethod
+    def _lead_record(lead_data: dict) -> dict:
+        """Returns the Zoho lead record for a normalized lead_data dictionary."""
         # Extract data from the normalized lead_data
         first_name = lead_data.get('first_name', '')
         last_name = lead_data.get('last_name', '')
@@ -84,49 +241,97 @@ class ZohoCRM:
             # Fallback if both are missing, though parser should prevent this
             last_name = "Unknown"
 
-        create_url = f"{self.api_url}/crm/v2/Leads"
-        headers = {
-            "Authorization": f"Zoho-oauthtoken {access_token}",
-            "Content-Type": "application/json"
+        return {
+            "First_Name": first_name,
+            "Last_Name": last_name,
+            "Email": email,
+            "Phone": phone,
+            # Add other fields as needed, e.g., "Lead_Source": "WhatsApp Chatbot"
         }
 
-        payload = {
-            "data": [
-                {
-                    "First_Name": first_name,
-                    "Last_Name": last_name,
-                    "Email": email,
-                    "Phone": phone,
-                    # Add other fields as needed, e.g., "Lead_Source": "WhatsApp Chatbot"
-                }
-            ]
-        }
+    def _create_result(self, data: dict, response_text: str) -> dict | None:
+        """Returns the created lead's details from a lead creation response, or None if Zoho didn't create it."""
+        if data.get('data') and len(data['data']) > 0 and data['data'][0].get('status') == 'success':
+            created_lead_id = data['data'][0]['details']['id']
+            logger.info("[ZohoCRM] Lead created successfully with ID: %s for tenant %s.", created_lead_id, self.auth_manager.tenant_id)
+            return data['data'][0]['details']
+        logger.error("[ZohoCRM ERROR] Failed to create lead for tenant %s: %s", self.auth_manager.tenant_id, data.get('message', 'Unknown error'))
+        if response_text:
+            logger.error("[ZohoCRM ERROR] Zoho API Response: %s", response_text)
+        return None
+
+    async def _async_access_token(self) -> str | None:
+        """
+        Returns an access token for the async calls. A cached token is read on the event loop; only fetching a
+        new one runs in a worker thread, so most calls don't wait for a thread at all.
+        """
+        return self.auth_manager.get_cached_access_token() or await asyncio.to_thread(self.auth_manager.get_access_token)
+
+    async def async_search_lead(self, phone_number: str) -> dict | None:
+        """
+        Async variant of search_lead: the API call runs on the shared aiohttp session, so the event loop serves
+        other users while Zoho answers. Only fetching a new access token runs in a worker thread.
+        """
+        access_token = await self._async_access_token()
+        if not access_token:
+            logger.error("[ZohoCRM ERROR] Could not get access token for searching leads for tenant %s.", self.auth_manager.tenant_id)
+            return None
 
         try:
-            print(f"[ZohoCRM] Creating new lead: {first_name} {last_name} ({phone}) for tenant {self.auth_manager.tenant_id}.")
-            response = requests.post(create_url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('data') and len(data['data']) > 0 and data['data'][0].get('status') == 'success':
-                created_lead_id = data['data'][0]['details']['id']
-                print(f"[ZohoCRM] Lead created successfully with ID: {created_lead_id} for tenant {self.auth_manager.tenant_id}.")
-                return data['data'][0]['details']
-            else:
-                print(f"[ZohoCRM ERROR] Failed to create lead for tenant {self.auth_manager.tenant_id}: {data.get('message', 'Unknown error')}")
-                if response and response.text:
-                    print(f"[ZohoCRM ERROR] Zoho API Response: {response.text}")
+            logger.info("[ZohoCRM] Searching for lead with phone: %s for tenant %s.", phone_number, self.auth_manager.tenant_id)
+            url, headers, params = self._search_request(access_token, phone_number)
+
+            async def send():
+                async with get_crm_session().get(url, headers=headers, params=params) as response:
+                    return response.status, await response.read()
+            # A search only reads, so connection errors, timeouts, 429s and 5xx are all safe to retry
+            status, body = await send_with_retries(send, retry_exceptions=(aiohttp.ClientConnectionError, asyncio.TimeoutError))
+            if status >= 400:
+                logger.error("[ZohoCRM ERROR] HTTP error %s during lead search for tenant %s.", status, self.auth_manager.tenant_id)
+                logger.error("[ZohoCRM ERROR] Zoho API Response: %s", body.decode(errors='replace'))
                 return None
+            return self._search_result(orjson.loads(body) if body else {}, phone_number) # No body (204): no lead
 
-        except requests.exceptions.RequestException as e:
-            print(f"[ZohoCRM ERROR] HTTP error during lead creation for tenant {self.auth_manager.tenant_id}: {e}")
-            if response and response.text:
-                print(f"[ZohoCRM ERROR] Zoho API Response: {response.text}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("[ZohoCRM ERROR] HTTP error during lead search for tenant %s: %r", self.auth_manager.tenant_id, e)
             return None
-        except json.JSONDecodeError:
-            print(f"[ZohoCRM ERROR] Invalid JSON response during lead creation for tenant {self.auth_manager.tenant_id}: {response.text}")
+        except orjson.JSONDecodeError:
+            logger.error("[ZohoCRM ERROR] Invalid JSON response during lead search for tenant %s: %s", self.auth_manager.tenant_id, body.decode(errors='replace'))
             return None
         except Exception as e:
-            print(f"[ZohoCRM ERROR] An unexpected error occurred during lead creation for tenant {self.auth_manager.tenant_id}: {e}")
+            logger.error("[ZohoCRM ERROR] An unexpected error occurred during lead search for tenant %s: %s", self.auth_manager.tenant_id, e)
             return None
 
+    async def async_create_lead(self, lead_data: dict) -> dict | None:
+        """
+        Async variant of create_lead, on the shared aiohttp session like async_search_lead.
+        """
+        access_token = await self._async_access_token()
+        if not access_token:
+            logger.error("[ZohoCRM ERROR] Could not get access token for creating lead for tenant %s.", self.auth_manager.tenant_id)
+            return None
+
+        try:
+            url, headers, payload = self._create_request(access_token, lead_data)
+
+            async def send():
+                async with get_crm_session().post(url, headers=headers, data=payload) as response:
+                    return response.status, await response.read()
+            # Only a rate-limited (429) insert is certain not to have been processed; retrying anything else
+            # could create the lead twice
+            status, body = await send_with_retries(send, retry_statuses=(429,))
+            if status >= 400:
+                logger.error("[ZohoCRM ERROR] HTTP error %s during lead creation for tenant %s.", status, self.auth_manager.tenant_id)
+                logger.error("[ZohoCRM ERROR] Zoho API Response: %s", body.decode(errors='replace'))
+                return None
+            return self._create_result(orjson.loads(body), body.decode(errors='replace'))
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("[ZohoCRM ERROR] HTTP error during lead creation for tenant %s: %r", self.auth_manager.tenant_id, e)
+            return None
+        except orjson.JSONDecodeError:
+            logger.error("[ZohoCRM ERROR] Invalid JSON response during lead creation for tenant %s: %s", self.auth_manager.tenant_id, body.decode(errors='replace'))
+            return None
+        except Exception as e:
+            logger.error("[ZohoCRM ERROR] An unexpected error occurred during lead creation for tenant %s: %s", self.auth_manager.tenant_id, e)
+            return None
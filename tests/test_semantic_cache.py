@@ -0,0 +1,36 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "console_chatbot"))
+
+from semantic_cache import SemanticCache, answer_namespace
+
+
+class SemanticCacheTest(unittest.TestCase):
+    def test_answer_is_not_shared_between_users(self):
+        cache = SemanticCache(threshold=0.95, maxsize=64, ttl=3600, max_namespaces=1024)
+        embedding = [0.1, 0.2, 0.3]
+        user_a = answer_namespace("tenant", "user-a", "gemini", "https://example.com")
+        user_b = answer_namespace("tenant", "user-b", "gemini", "https://example.com")
+
+        cache.set(user_a, embedding, "Nice to see you again, Alice!")
+
+        self.assertEqual(cache.get(user_a, embedding), "Nice to see you again, Alice!")
+        self.assertIsNone(cache.get(user_b, embedding))
+
+    def test_least_recently_used_namespace_is_dropped(self):
+        cache = SemanticCache(max_namespaces=2)
+        embedding = [1.0, 0.0]
+        cache.set("a", embedding, "a")
+        cache.set("b", embedding, "b")
+        cache.get("a", embedding)
+        cache.set("c", embedding, "c")
+
+        self.assertEqual(cache.get("a", embedding), "a")
+        self.assertIsNone(cache.get("b", embedding))
+        self.assertEqual(cache.get("c", embedding), "c")
+
+
+if __name__ == "__main__":
+    unittest.main()
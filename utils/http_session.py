@@ -0,0 +1,57 @@
+import logging
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds for API calls made with these sessions, so a stalled server can't hold a
+# worker thread forever; the connect timeout is just above a multiple of 3 s, the TCP retransmission window
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Deployment-wide minimum pool sizes, e.g. raised for many tenants or worker threads without code changes
+_MIN_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "0"))
+_MIN_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "0"))
+
+# urllib3 reports "Connection pool is full, discarding connection" at WARNING when pool_maxsize is too small
+# for the concurrency; keep it visible even if the app turns other library logging down
+logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
+
+def create_http_adapter(pool_connections: int = 4, pool_maxsize: int = 16, retries: int = 3,
+                        retry_methods=Retry.DEFAULT_ALLOWED_METHODS) -> HTTPAdapter:
+    """
+    Creates the keep-alive, retrying HTTPAdapter that create_http_session mounts, for mounting on specific URL
+    prefixes of a session (see create_http_session for the arguments).
+    The HTTP_POOL_CONNECTIONS and HTTP_POOL_MAXSIZE environment variables raise its pool sizes.
+    Returns:
+        HTTPAdapter: The configured adapter.
+    """
+    retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(retry_methods), raise_on_status=False)
+    return HTTPAdapter(pool_connections=max(pool_connections, _MIN_POOL_CONNECTIONS),
+                       pool_maxsize=max(pool_maxsize, _MIN_POOL_MAXSIZE), max_retries=retry, pool_block=False)
+
+def create_http_session(pool_connections: int = 4, pool_maxsize: int = 16, retries: int = 3,
+                        retry_methods=Retry.DEFAULT_ALLOWED_METHODS) -> requests.Session:
+    """
+    Creates a requests.Session whose pooled connections are kept alive between calls, so only the first
+    request to a host pays for the TCP and TLS handshakes.
+    Connection errors, and RETRY_STATUSES responses to retry_methods requests, are retried with exponential back-off.
+    The HTTP_POOL_CONNECTIONS and HTTP_POOL_MAXSIZE environment variables raise the pool sizes of every session.
+    Pools don't block: a request beyond pool_maxsize still gets a connection, which is discarded afterwards.
+    Args:
+        pool_connections (int): Number of hosts to keep connection pools for.
+        pool_maxsize (int): Connections kept per host; size it to the number of threads calling at once.
+        retries (int): Maximum retries per request.
+        retry_methods (iterable[str]): HTTP methods retried on a RETRY_STATUSES response. Defaults to the
+            idempotent methods; only add POST for calls that are safe to repeat.
+    Returns:
+        requests.Session: The configured session.
+    """
+    adapter = create_http_adapter(pool_connections, pool_maxsize, retries, retry_methods)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
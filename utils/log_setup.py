@@ -0,0 +1,32 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """
+    Sets up root logging like logging.basicConfig, except that records are only put on a queue by the logging
+    thread; a background listener thread formats and writes them to stderr. Request threads and the event loop
+    therefore never wait on console I/O or the stream lock to log.
+    Calling it again has no effect.
+    Args:
+        level (int): The root logger level.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop) # Writes out the records still queued at exit
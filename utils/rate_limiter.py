@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+class AsyncTokenBucket:
+    """
+    An asyncio token-bucket rate limiter: allows bursts of up to `capacity` calls and refills at `rate` calls
+    per second. Callers over the limit wait for a token (in arrival order) instead of failing.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Args:
+            rate (float): Tokens added per second, i.e. the sustained calls per second.
+            capacity (float, optional): Largest burst allowed; defaults to one second's worth of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
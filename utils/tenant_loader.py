@@ -1,6 +1,13 @@
 import json
 import os
+import sys
 import logging
+from collections.abc import Mapping
+from types import MappingProxyType
+try:
+    import orjson # C-based JSON parser, several times faster than json on the tenants file
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
@@ -9,51 +16,90 @@ logger = logging.getLogger(__name__)
 # and tenants.json is in chat_rag_app_exercise6/config/
 _TENANTS_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'tenants.json')
 
-_TENANTS_CACHE = {} # Cache to store loaded tenant configurations
+_TENANTS_CACHE = {} # Cache to store loaded tenant configurations, as read-only views shared by all callers
+_loaded_config = None # Parsed tenants.json as last returned by load_all_tenants_config
+_loaded_mtime = None # Modification time (ns) of tenants.json when _loaded_config was read
+# Modification time (ns) of a tenants.json that failed to load, or _FILE_MISSING, so each failure is read and
+# logged once rather than on every lookup until the file changes
+_failed_mtime = None
+_FILE_MISSING = -1
+
+def _last_loaded_config() -> dict:
+    """Returns the last successfully loaded configuration, or an empty one if none has loaded yet."""
+    return _loaded_config if _loaded_config is not None else {"tenants": []}
+
+def _set_loaded_config(config: dict, mtime: int) -> None:
+    """Makes config, read from tenants.json as of mtime (ns), the loaded configuration and refills the cache."""
+    global _loaded_config, _loaded_mtime, _failed_mtime
+    # Build the new cache completely before replacing the old one, so a bad entry can't leave it half-filled
+    tenants = {}
+    for tenant in config.get('tenants', []):
+        tenant_id = tenant.get('tenant_id')
+        if tenant_id:
+            # Interned, so lookups with an interned id (e.g. a literal) match on identity without comparing strings
+            tenants[sys.intern(tenant_id)] = MappingProxyType(tenant)
+    _TENANTS_CACHE.clear()
+    _TENANTS_CACHE.update(tenants)
+    _loaded_config, _loaded_mtime, _failed_mtime = config, mtime, None
+
+def prime_cache(config: dict, mtime_ns: int) -> None:
+    """
+    Loads a configuration that was just written to tenants.json, without reading the file back.
+    Args:
+        config (dict): The configuration as written, i.e. {"tenants": [...]}.
+        mtime_ns (int): The file's modification time in ns (os.stat(...).st_mtime_ns) after the write, so the
+            next load_all_tenants_config() sees the file as already loaded.
+    """
+    _set_loaded_config(config, mtime_ns)
 
 def load_all_tenants_config() -> dict:
     """
     Loads all tenant configurations from the tenants.json file.
+    The file is only read and parsed again when its modification time has changed since the last load.
+    If the file is missing or invalid, the last successfully loaded tenants are kept (and returned), so a bad
+    edit doesn't take every tenant offline; the problem is logged once.
     Returns:
         dict: A dictionary containing all tenant configurations.
     """
-    if not os.path.exists(_TENANTS_CONFIG_PATH):
-        logger.error(f"Tenants configuration file not found at: {_TENANTS_CONFIG_PATH}")
-        return {"tenants": []} # Return empty list if file not found
-
+    global _failed_mtime
     try:
-        with open(_TENANTS_CONFIG_PATH, 'r') as f:
-            config = json.load(f)
+        mtime = os.stat(_TENANTS_CONFIG_PATH).st_mtime_ns # ns, so two saves within one second still differ
+    except OSError:
+        if _failed_mtime != _FILE_MISSING:
+            _failed_mtime = _FILE_MISSING
+            logger.error(f"Tenants configuration file not found at: {_TENANTS_CONFIG_PATH}; keeping the last loaded tenants.")
+        return _last_loaded_config()
+
+    if mtime == _loaded_mtime:
+        return _loaded_config
+    if mtime == _failed_mtime:
+        return _last_loaded_config()
 
-        # Populate cache
-        _TENANTS_CACHE.clear()
-        for tenant in config.get('tenants', []):
-            tenant_id = tenant.get('tenant_id')
-            if tenant_id:
-                _TENANTS_CACHE[tenant_id] = tenant
+    try:
+        with open(_TENANTS_CONFIG_PATH, 'rb') as f:
+            config = orjson.loads(f.read()) if orjson else json.loads(f.read())
 
+        _set_loaded_config(config, mtime)
         logger.info(f"Loaded {len(_TENANTS_CACHE)} tenant configurations from {_TENANTS_CONFIG_PATH}")
         return config
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding tenants.json: {e}")
-        return {"tenants": []}
+    except ValueError as e: # json.JSONDecodeError and orjson.JSONDecodeError both subclass ValueError
+        logger.error(f"Error decoding tenants.json: {e}; keeping the last loaded tenants.")
     except Exception as e:
-        logger.error(f"An unexpected error occurred loading tenants.json: {e}")
-        return {"tenants": []}
+        logger.error(f"An unexpected error occurred loading tenants.json: {e}; keeping the last loaded tenants.")
+    _failed_mtime = mtime
+    return _last_loaded_config()
 
-def get_tenant_config(tenant_id: str) -> dict | None:
+def get_tenant_config(tenant_id: str) -> Mapping | None:
     """
     Retrieves the configuration for a specific tenant ID.
+    tenants.json is loaded on first use and reloaded only after it changes, so a lookup is usually one stat
+    call and a dict lookup, and edits made through the admin dashboard are picked up without a restart.
     Args:
         tenant_id (str): The ID of the tenant to retrieve.
     Returns:
-        dict | None: The tenant's configuration dictionary if found, otherwise None.
+        Mapping | None: A read-only view of the tenant's configuration if found, otherwise None.
+        It is shared with every other caller, so copy it (dict(...)) before changing it.
     """
-    if not _TENANTS_CACHE: # Load if cache is empty
-        load_all_tenants_config()
-
+    load_all_tenants_config()
     return _TENANTS_CACHE.get(tenant_id)
 
-# Load tenants on module import
-load_all_tenants_config()
-
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import threading
+import time
+
+class RefreshTokenStore:
+    """
+    Keeps OAuth refresh tokens for all tenants in a single SQLite database, keyed by tenant_id, so a lookup
+    is one indexed query instead of opening a file per tenant.
+    One store (and connection) is meant to be shared by the whole process; it is safe to use from any thread.
+    """
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path (str): Path of the SQLite database file; it is created if it doesn't exist.
+        """
+        self.db_path = db_path
+        # Create the database readable by its owner only, as it holds credentials; SQLite gives its -wal and
+        # -shm files the same permissions
+        os.close(os.open(db_path, os.O_WRONLY | os.O_CREAT, 0o600))
+        # Autocommit mode: every write is its own transaction, committed at once
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock() # One sqlite3 connection must not run statements from two threads at once
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL") # Readers in other processes don't block on writes
+            # fsync every commit, so a saved token survives a crash or power loss (token writes are rare)
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS zoho_refresh_tokens ("
+                "tenant_id TEXT PRIMARY KEY, token TEXT NOT NULL, updated_at INTEGER NOT NULL)"
+            )
+
+    def get(self, tenant_id: str) -> str | None:
+        """
+        Returns the tenant's refresh token, or None if none is stored.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT token FROM zoho_refresh_tokens WHERE tenant_id = ?", (tenant_id,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, tenant_id: str, token: str) -> bool:
+        """
+        Stores the tenant's refresh token, replacing any previous one.
+        Storing the token the tenant already has writes nothing to disk.
+        Returns:
+            bool: True if the stored token changed, False if it was already stored.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO zoho_refresh_tokens (tenant_id, token, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (tenant_id) DO UPDATE SET token = excluded.token, updated_at = excluded.updated_at "
+                "WHERE token != excluded.token",
+                (tenant_id, token, int(time.time())))
+            return cursor.rowcount > 0
+
+    def delete(self, tenant_id: str) -> None:
+        """
+        Removes the tenant's refresh token, if any.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM zoho_refresh_tokens WHERE tenant_id = ?", (tenant_id,))
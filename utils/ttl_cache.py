@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries also expire after a fixed time-to-live.
+    Once the cache is full, the least recently used entry is evicted.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, sliding: bool = False, on_evict=None):
+        """
+        Args:
+            maxsize (int): Maximum number of entries kept in the cache.
+            ttl (float): Seconds an entry stays valid after it was stored.
+            sliding (bool): If True, every get() also restarts the entry's time-to-live, so only entries
+                left unused for ttl seconds expire.
+            on_evict (callable, optional): Called as on_evict(key, value) when a full cache evicts an entry.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self._entries = OrderedDict() # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                del self._entries[key]
+                return default
+            if self.sliding:
+                self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        """
+        Stores value under key, evicting the least recently used entry if the cache is full.
+        """
+        evicted = None
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                evicted_key, (_, evicted_value) = self._entries.popitem(last=False)
+                evicted = (evicted_key, evicted_value)
+        if evicted and self.on_evict:
+            self.on_evict(*evicted)
+
+    def pop(self, key, default=None):
+        """
+        Removes key from the cache and returns its value, or default if it was not cached.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def items(self) -> list:
+        """
+        Returns a snapshot of the unexpired (key, value) pairs, least recently used first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)